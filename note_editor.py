@@ -11,12 +11,16 @@ from PyQt6.QtWidgets import (
     QInputDialog, QMenu, QTableWidget, QTableWidgetItem,
     QSpinBox, QDialogButtonBox, QColorDialog
 )
-from PyQt6.QtCore import Qt, QSize, QUrl, QMimeData, QByteArray, QBuffer, QIODevice
+from PyQt6.QtCore import (
+    Qt, QSize, QPoint, QPointF, QRect, QRectF, QUrl, QMimeData, QByteArray, QBuffer, QIODevice, QTimer,
+    QElapsedTimer, QObject, QRunnable, QThreadPool, pyqtSignal
+)
 from PyQt6.QtGui import (
     QTextCursor, QFont, QTextCharFormat, QColor, QAction,
     QTextBlockFormat, QTextListFormat, QTextTableFormat,
     QTextFrameFormat, QTextLength, QImage, QPixmap, QClipboard,
-    QTextImageFormat, QTextFormat, QTextDocument
+    QTextImageFormat, QTextFormat, QTextDocument, QPainter, QPainterPath, QPen,
+    QPolygonF, QTextBlock
 )
 
 from math_renderer import MathRenderer
@@ -24,13 +28,150 @@ import os
 import uuid
 from pathlib import Path
 import base64
+import bisect
+import collections
+import functools
+import hashlib
 import html
 import re
 import logging
+import platform
+import struct
+import subprocess
 import traceback
 
 logger = logging.getLogger(__name__)
 
+# 当前操作系统名（platform.system() 的结果在进程内不变）
+_PLATFORM = platform.system()
+
+# 按操作系统选择打开本地文件的方式
+_OPEN_FILE_HANDLERS = {
+    'Darwin': lambda path: subprocess.run(['open', path]),  # macOS
+    'Windows': lambda path: os.startfile(path),
+    'Linux': lambda path: subprocess.run(['xdg-open', path]),
+}
+
+# 插入图片的最大宽度（超过则等比缩放）
+_MAX_IMAGE_WIDTH = 800
+
+# 文件大小的显示单位，从大到小匹配
+_SIZE_UNITS = ((1 << 30, "GB"), (1 << 20, "MB"), (1 << 10, "KB"))
+
+# 标题级别对应的字号：1 标题（首行标题格式）、2 小标题、3 副标题（均为粗体）
+_HEADING_SIZES = {1: 28, 2: 22, 3: 18}
+
+# 拖放/粘贴时按扩展名识别为图片的文件类型
+_IMAGE_EXTENSIONS = frozenset({'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.svg'})
+
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# 公式图片在交互路径上用快速压缩编码：Qt 的 PNG quality 映射为 zlib 压缩级别
+# (100 - quality) * 9 / 91，85 对应级别1（相当于 PIL 的 compress_level=1）
+_PNG_FAST_QUALITY = 85
+
+# 编辑期间公式图片以短URL命名，图片本身登记为文档资源；
+# 保存（toHtml）时再还原为 data:image/png;base64,...|||MATH:type:code 格式
+_FORMULA_URL_PREFIX = "formula://"
+_FORMULA_SRC_RE = re.compile(r'src="(formula://[0-9a-f]+)"')
+
+# 选区 HTML 中的附件链接 attachment://<id>
+_ATTACHMENT_ID_RE = re.compile(r"attachment://([a-fA-F0-9\-]{16,})")
+
+# QTextFormat.ObjectType 属性号（int），附件标记存放在字符格式的 objectType 上
+_OBJECT_TYPE_PROP = QTextFormat.Property.ObjectType.value
+
+# 图片缩放控制点 -> (宽度方向, 高度方向)：-1 向左/上拖动时增大，1 向右/下拖动时增大，0 不变
+_HANDLE_DELTAS = {
+    'tl': (-1, -1), 't': (0, -1), 'tr': (1, -1),
+    'l': (-1, 0), 'r': (1, 0),
+    'bl': (-1, 1), 'b': (0, 1), 'br': (1, 1),
+}
+# 四个角落控制点（缩放时保持宽高比）
+_CORNER_HANDLES = frozenset({'tl', 'tr', 'bl', 'br'})
+
+# 文本内容的HTML转义表（用于 str.translate）
+_HTML_ESCAPE_TABLE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+# 公式代码反转义（双击编辑公式时使用）
+_HTML_UNESCAPE = html.unescape
+
+# 调试输出中不可见字符的显示替换表（用于 str.translate）
+_DUMP_ESCAPE_TABLE = str.maketrans({
+    '\u200b': '<ZWSP>', '\u2029': '<PSEP>', '\n': '<LF>', '\r': '<CR>', '\\': '\\\\',
+})
+
+
+def _png_header_info(data: bytes) -> tuple | None:
+    """读取PNG的IHDR头，返回 (宽, 高, 颜色类型)；不是合法PNG时返回None"""
+    if len(data) < 26 or not data.startswith(_PNG_SIGNATURE) or data[12:16] != b'IHDR':
+        return None
+    width, height = struct.unpack('>II', data[16:24])
+    return width, height, data[25]
+
+
+def _single_property_format(setter, value) -> QTextCharFormat:
+    """创建只设置了一个属性的字符格式（用作 mergeCharFormat 的增量）"""
+    fmt = QTextCharFormat()
+    setter(fmt, value)
+    return fmt
+
+
+def _flatten_on_white(image: QImage) -> QImage:
+    """在白色背景上合成图片，去除 alpha 通道（PNG 更小），返回 RGB888 图片"""
+    if not image.hasAlphaChannel():
+        return image.convertToFormat(QImage.Format.Format_RGB888)
+    flat = QImage(image.size(), QImage.Format.Format_RGB888)
+    flat.fill(Qt.GlobalColor.white)
+    painter = QPainter(flat)
+    painter.drawImage(0, 0, image)
+    painter.end()
+    return flat
+
+
+def _encode_png_base64(image: QImage) -> str:
+    """把图片以快速压缩编码为PNG并转为base64（不依赖GUI线程，可在线程池中调用）"""
+    byte_array = QByteArray()
+    buffer = QBuffer(byte_array)
+    buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+    if not image.save(buffer, "PNG", _PNG_FAST_QUALITY):
+        raise RuntimeError("QImage.save 失败")
+    buffer.close()
+    # 在 Qt 内做 base64，不再把PNG字节先拷贝成 Python bytes
+    return byte_array.toBase64().data().decode('ascii')
+
+
+class _FormulaEncodeSignals(QObject):
+    """公式编码任务的信号（从工作线程投递回GUI线程）"""
+    finished = pyqtSignal(object, str)
+
+
+class _FormulaEncodeTask(QRunnable):
+    """在线程池中把公式图片编码为PNG/base64
+
+    matplotlib 的 pyplot 不是线程安全的，渲染仍在GUI线程完成，这里只负责编码。
+    """
+
+    def __init__(self, key, image):
+        super().__init__()
+        self.key = key
+        self.image = image
+        self.signals = _FormulaEncodeSignals()
+
+    def run(self):
+        try:
+            image_base64 = _encode_png_base64(self.image)
+        except Exception:
+            logger.exception("公式图片编码失败: %s", self.key[0])
+            return
+        self.signals.finished.emit(self.key, image_base64)
+
+
+def _format_has_tag(cf: QTextCharFormat, tag_prop: int, tag_value: int) -> bool:
+    """判断字符格式是否带有指定标记；标记存放在 objectType 上时直接比较整数，不经过 QVariant"""
+    if tag_prop == _OBJECT_TYPE_PROP:
+        return cf.objectType() == tag_value
+    return cf.hasProperty(tag_prop) and cf.property(tag_prop) == tag_value
+
 
 def _select_range(cursor: QTextCursor, start: int, end: int) -> bool:
     """统一的选中字符范围的函数，使用movePosition方式。
@@ -64,25 +205,6 @@ def _select_char_at(cursor: QTextCursor, position: int) -> bool:
     return cursor.movePosition(QTextCursor.MoveOperation.Right, QTextCursor.MoveMode.KeepAnchor, 1)
 
 
-def _selected_char_format(
-    doc: QTextDocument,
-    p: int,
-) -> QTextCharFormat | None:
-    doc_len = doc.characterCount()
-    if doc_len <= 0 or p < 0 or p > doc_len - 1:
-        return None
-
-    c0 = QTextCursor(doc)
-    if not _select_char_at(c0, p):
-        return None
-
-    # 输出选中的字符（调试用）
-    selected_char = c0.selectedText()
-    # print(f"[DEBUG] 位置 {p} 选中的字符: '{selected_char}' (Unicode: {ord(selected_char) if selected_char else 'N/A'})")
-
-    return c0.charFormat()
-
-
 def _get_char_at(doc: QTextDocument, position: int) -> str:
     """获取文档中指定位置的字符（全局辅助函数）。
     
@@ -93,87 +215,288 @@ def _get_char_at(doc: QTextDocument, position: int) -> str:
     Returns:
         该位置的字符，如果无法获取则返回空字符串
     """
-    c = QTextCursor(doc)
-    if not _select_char_at(c, position):
+    # 直接读字符，不构造光标/选区；文档最后一个位置（末尾段落分隔符）无字符可选中，返回空串
+    if position < 0 or position >= doc.characterCount() - 1:
         return ""
-    return c.selectedText() or ""
+    ch = doc.characterAt(position)
+    if '\ud800' <= ch <= '\udbff':
+        # 代理对（如 emoji）只读到高位代理，退回按字素选中以得到完整字符
+        c = QTextCursor(doc)
+        _select_char_at(c, position)
+        return c.selectedText()
+    return ch
 
 
-def _is_marked_at(
-        doc: QTextDocument,
-        p: int,
-        tag_prop: int,
-        tag_value: str
-) -> bool:
-    """检查指定位置的字符是否具有指定的标记属性。
+def _iter_doc_chars(doc: QTextDocument, start: int, end: int):
+    """按块读取文本，逐个产出 (位置, 字符)，范围为闭区间 [start, end]。
 
-    Args:
-        doc: 文档对象
-        p: 要检查的位置
-        tag_prop: 标记属性ID
-        tag_value: 标记属性值
-
-    Returns:
-        如果该位置字符具有指定标记则返回 True，否则返回 False
+    块内字符直接取自 block.text()；块末尾的段落分隔符产出 U+2029，文档最后一个位置
+    无字符可选中，产出空串。块与块之间的空隙（表格/框架边界）退回 _get_char_at。
     """
-    cf0 = _selected_char_format(doc, p)
-    return bool(cf0) and cf0.hasProperty(tag_prop) and cf0.property(tag_prop) == tag_value
+    last = max(0, int(doc.characterCount()) - 1)
+    i = start
+    block = doc.findBlock(start)
+    while i <= end:
+        if not block.isValid():
+            yield i, _get_char_at(doc, i)
+            i += 1
+            continue
+        b_pos = block.position()
+        if i < b_pos:
+            yield i, _get_char_at(doc, i)
+            i += 1
+            continue
+        text = block.text()
+        sep_pos = b_pos + len(text)
+        if i < sep_pos:
+            stop = min(end + 1, sep_pos)
+            yield from enumerate(text[i - b_pos:stop - b_pos], start=i)
+            i = stop
+            continue
+        if i == sep_pos:
+            yield i, ("" if i >= last else "\u2029")
+            i += 1
+        block = block.next()
+
+
+def _format_dump_items(chars) -> str:
+    """把 (位置, 字符) 序列格式化为调试字符串"""
+    items = []
+    for i, ch in chars:
+        if ch == "":
+            ch = "∅"
+        cp = " ".join(map("U+{:04X}".format, map(ord, ch)))
+        show = ch.translate(_DUMP_ESCAPE_TABLE)
+        # 只有其余的非 ASCII / 不可打印字符才需要 unicode_escape
+        if not (show.isascii() and show.isprintable()):
+            show = show.encode("unicode_escape", errors="backslashreplace").decode("ascii")
+        items.append(f"{i}:{show}({cp})")
+    return " ".join(items)
 
 
 def _dump_doc_chars(doc: QTextDocument, start: int, end: int) -> str:
-    """输出文档指定范围的每个字符及其 codepoint，便于定位不可见字符。"""
+    """输出文档指定范围的每个字符及其 codepoint，便于定位不可见字符。
+
+    仅在 DEBUG 日志开启时才逐字符格式化，否则直接返回空串。
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return ""
     try:
         start = max(0, start)
         end = min(max(0, int(doc.characterCount()) - 1), end)
-        items = []
-        for i in range(start, end + 1):
-            ch = _get_char_at(doc, i)
-            if ch == "":
-                ch = "∅"
-            cp = " ".join([f"U+{ord(x):04X}" for x in ch])
-            show = ch.encode("unicode_escape", errors="backslashreplace").decode("ascii")
-            show = show.replace("\\u200b", "<ZWSP>").replace("\\u2029", "<PSEP>")
-            show = show.replace("\\n", "<LF>").replace("\\r", "<CR>")
-            items.append(f"{i}:{show}({cp})")
-        return " ".join(items)
+        return _format_dump_items(_iter_doc_chars(doc, start, end))
     except Exception as e:
         return f"<dump_failed:{e}>"
 
 
 def _dump_selection_chars(doc: QTextDocument, cur: QTextCursor) -> str:
-    """输出 QTextCursor 当前选区的逐字符信息（依赖 doc）。"""
+    """输出 QTextCursor 当前选区的逐字符信息（依赖 doc）。
+
+    仅在 DEBUG 日志开启时才逐字符格式化，否则直接返回空串。
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return ""
     try:
         s = cur.selectionStart()
         e = cur.selectionEnd()
         if e <= s:
             return "<empty>"
-        items = []
-        for i in range(s, e):
-            ch = _get_char_at(doc, i)
-            if ch == "":
-                ch = "∅"
-            cp = " ".join([f"U+{ord(x):04X}" for x in ch])
-            show = ch.encode("unicode_escape", errors="backslashreplace").decode("ascii")
-            show = show.replace("\\u200b", "<ZWSP>").replace("\\u2029", "<PSEP>")
-            show = show.replace("\\n", "<LF>").replace("\\r", "<CR>")
-            items.append(f"{i}:{show}({cp})")
-        return " ".join(items)
+        return _format_dump_items(_iter_doc_chars(doc, s, e - 1))
     except Exception as e:
         return f"<sel_dump_failed:{e}>"
 
+def _marked_with_cursor(
+    cursor: QTextCursor,
+    p: int,
+    doc_len: int,
+    tag_prop: int,
+    tag_value: int,
+    memo: dict,
+) -> bool:
+    """用调用方提供的同一个光标检查位置 p 的字符是否带有标记（结果记在 memo 中，避免重复查询）"""
+    marked = memo.get(p)
+    if marked is None:
+        marked = False
+        if 0 <= p < doc_len - 1:
+            cursor.setPosition(p)
+            if cursor.movePosition(QTextCursor.MoveOperation.Right, QTextCursor.MoveMode.KeepAnchor, 1):
+                cf = cursor.charFormat()
+                marked = _format_has_tag(cf, tag_prop, tag_value)
+        memo[p] = marked
+    return marked
+
+
+def _scan_marked_run(
+    cursor: QTextCursor,
+    start_pos: int,
+    direction: int,
+    doc_len: int,
+    tag_prop: int,
+    tag_value: int,
+    memo: dict,
+) -> int:
+    """从已知带标记的 start_pos 沿 direction（+1/-1）扩展，返回该方向上连续标记的最远位置（包含）"""
+    p = start_pos
+    while _marked_with_cursor(cursor, p + direction, doc_len, tag_prop, tag_value, memo):
+        p += direction
+    return p
+
+
+def _marked_boundary_kind(
+    cursor: QTextCursor,
+    pos: int,
+    doc_len: int,
+    tag_prop: int,
+    tag_value: int,
+    memo: dict,
+) -> str | None:
+    """判断 pos 是标记范围的起点（"start"）、右开端点（"end"）还是都不是（None）
+
+    只在本次查询内借助 memo 复用逐字符判定结果，不跨调用缓存（文档内容随时可能变化）。
+    """
+    here = _marked_with_cursor(cursor, pos, doc_len, tag_prop, tag_value, memo)
+    before = pos > 0 and _marked_with_cursor(cursor, pos - 1, doc_len, tag_prop, tag_value, memo)
+    if here and not before:
+        kind = "start"
+    elif before and not here:
+        kind = "end"
+    else:
+        kind = None
+    return kind
+
+
+def _find_fragment_with_property(
+    doc: QTextDocument,
+    pos: int,
+    prop: int,
+    value,
+) -> tuple[int, int] | None:
+    """返回包含 pos 且带有指定属性值的连续片段范围 (start, end_exclusive)
+
+    同一格式的连续字符在 Qt 中是一个 QTextFragment，因此只需在 pos 所在块内按片段查找；
+    同一附件若因格式不同被拆成多个相邻片段，会一并合并进范围。
+    pos 不在任何片段内（例如块末尾的段落分隔符）或片段不带该属性时返回 None。
+    """
+    block = doc.findBlock(pos)
+    if not block.isValid():
+        return None
+    # 片段迭代器只能向前，先收集整块的片段再双向合并
+    frags = []
+    hit = -1
+    it = block.begin()
+    while not it.atEnd():
+        frag = it.fragment()
+        if frag.isValid():
+            start = frag.position()
+            end = start + frag.length()
+            if hit < 0 and start <= pos < end:
+                hit = len(frags)
+            frags.append((start, end, _format_has_tag(frag.charFormat(), prop, value)))
+        it += 1
+    if hit < 0 or not frags[hit][2]:
+        return None
+    first = last = hit
+    while first > 0 and frags[first - 1][2] and frags[first - 1][1] == frags[first][0]:
+        first -= 1
+    while last + 1 < len(frags) and frags[last + 1][2] and frags[last + 1][0] == frags[last][1]:
+        last += 1
+    return (frags[first][0], frags[last][1])
+
+
+def _fragment_at(doc: QTextDocument, pos: int):
+    """返回包含 pos 的 QTextFragment；pos 落在段落分隔符等非片段位置时返回 None"""
+    block = doc.findBlock(pos)
+    if not block.isValid():
+        return None
+    it = block.begin()
+    while not it.atEnd():
+        frag = it.fragment()
+        if frag.isValid():
+            start = frag.position()
+            if start <= pos < start + frag.length():
+                return frag
+            if start > pos:
+                break
+        it += 1
+    return None
+
+
+def _iter_fragments(block: QTextBlock):
+    """遍历块内的片段，依次产出 (起始位置, 长度, 字符格式)"""
+    it = block.begin()
+    while not it.atEnd():
+        frag = it.fragment()
+        if frag.isValid():
+            yield frag.position(), frag.length(), frag.charFormat()
+        it += 1
+
+
+def _count_marked_fragments(doc: QTextDocument, start: int, end: int, prop: int, value) -> int:
+    """统计与 [start, end) 相交、且带有指定属性值的片段个数（按块/片段遍历，不逐字符）"""
+    count = 0
+    block = doc.findBlock(max(0, start))
+    while block.isValid() and block.position() < end:
+        it = block.begin()
+        while not it.atEnd():
+            frag = it.fragment()
+            if frag.isValid():
+                f_start = frag.position()
+                if f_start >= end:
+                    break
+                if f_start + frag.length() > start:
+                    if _format_has_tag(frag.charFormat(), prop, value):
+                        count += 1
+            it += 1
+        block = block.next()
+    return count
+
+
+def _collect_anchor_hrefs(doc: QTextDocument, start: int, end: int) -> set:
+    """收集与 [start, end) 相交的片段上的链接地址（按块/片段遍历，不序列化 HTML）"""
+    hrefs = set()
+    block = doc.findBlock(max(0, start))
+    while block.isValid() and block.position() < end:
+        it = block.begin()
+        while not it.atEnd():
+            frag = it.fragment()
+            if frag.isValid():
+                f_start = frag.position()
+                if f_start >= end:
+                    break
+                if f_start + frag.length() > start:
+                    cf = frag.charFormat()
+                    if cf.isAnchor():
+                        href = cf.anchorHref()
+                        if href:
+                            hrefs.add(href)
+            it += 1
+        block = block.next()
+    return hrefs
+
+
+def _extend_run_end(doc, cursor, end, doc_len, tag_prop, tag_value, memo) -> int:
+    """片段范围止于块末尾且段落分隔符也带标记时，逐字符向后扩展，返回右开端点"""
+    block = doc.findBlock(end)
+    if end == block.position() + len(block.text()) and _marked_with_cursor(
+        cursor, end, doc_len, tag_prop, tag_value, memo
+    ):
+        return _scan_marked_run(cursor, end, 1, doc_len, tag_prop, tag_value, memo) + 1
+    return end
+
+
 def _find_marked_span(
     doc: QTextDocument,
     pos: int,
     tag_prop: int,
-    tag_value: str,
+    tag_value: int,
 ) -> tuple[int, int] | None:
     """返回以 pos 为锚点的连续标记范围 (start, end_exclusive)。
 
-    注意：Qt 的 `QTextCursor.charFormat()` 在"无选区"时返回的是插入点格式，
-    不一定等价于该位置字符本身的格式。这里统一采用"先选中 1 个字符再取格式"。
-
     约定：这里的 pos 只可能是"标记范围起点 start_pos"或"标记范围末端 end_pos"。
-    因此优先把 pos 当作 start_pos 向右扩展；若失败再把 pos 当作 end_pos 向左扩展。
+    优先把 pos 当作 start_pos；若不是再把 pos 当作 end_pos（右开端点）。
+
+    先直接定位 pos（或 pos-1）所在块内的连续带标记片段，范围就是这些片段的并集；
+    只有标记碰到块边界、且段落分隔符本身也带标记时，才逐字符跨块扩展。
     """
     try:
         if not tag_value:
@@ -183,27 +506,43 @@ def _find_marked_span(
         if doc_len <= 0:
             return None
 
-        max_pos = doc_len - 1
-
-        # 1) 尝试把 pos 当作 start_pos：要求 pos 本身是标记，且 pos-1 不是标记
-        if _is_marked_at(doc, pos, tag_prop, tag_value) and \
-           (pos <= 0 or not _is_marked_at(doc, pos - 1, tag_prop, tag_value)):
-            start = pos
-            end_inclusive = pos
-            while end_inclusive < max_pos and _is_marked_at(doc, end_inclusive + 1, tag_prop, tag_value):
-                end_inclusive += 1
-            return (start, end_inclusive + 1)
-
-        # 2) 尝试把 pos 当作 end_pos（即 end_exclusive）：要求 pos-1 是标记，且 pos 本身不是标记
-        #    这样 pos 落在标记范围的"右开端点"上（例如插入后 cursor.position()）。
-        if pos > 0 and \
-           _is_marked_at(doc, pos - 1, tag_prop, tag_value) and \
-           not _is_marked_at(doc, pos, tag_prop, tag_value):
-            end_inclusive = pos - 1
-            start = end_inclusive
-            while start > 0 and _is_marked_at(doc, start - 1, tag_prop, tag_value):
-                start -= 1
-            return (start, end_inclusive + 1)
+        cursor = QTextCursor(doc)
+        memo = {}
+
+        run = _find_fragment_with_property(doc, pos, tag_prop, tag_value)
+        if run is not None:
+            # pos 本身带标记：只有当它是整个标记范围的起点时才返回
+            start, end = run
+            if start == doc.findBlock(start).position() and _marked_with_cursor(
+                cursor, start - 1, doc_len, tag_prop, tag_value, memo
+            ):
+                # 标记越过了上一段的段落分隔符（正常打标不会出现），逐字符向前扩展
+                start = _scan_marked_run(cursor, start - 1, -1, doc_len, tag_prop, tag_value, memo)
+            if start != pos:
+                return None
+            return (start, _extend_run_end(doc, cursor, end, doc_len, tag_prop, tag_value, memo))
+
+        if pos > 0:
+            run = _find_fragment_with_property(doc, pos - 1, tag_prop, tag_value)
+            if run is not None and run[1] == pos:
+                # pos 是右开端点：pos-1 带标记且 pos 本身不带标记（pos 为带标记的段落分隔符时不算）
+                if _extend_run_end(doc, cursor, pos, doc_len, tag_prop, tag_value, memo) != pos:
+                    return None
+                start = run[0]
+                if start == doc.findBlock(start).position() and _marked_with_cursor(
+                    cursor, start - 1, doc_len, tag_prop, tag_value, memo
+                ):
+                    start = _scan_marked_run(cursor, start - 1, -1, doc_len, tag_prop, tag_value, memo)
+                return (start, pos)
+
+        # 片段查不到时（如 pos 落在段落分隔符上），退回逐字符判定
+        kind = _marked_boundary_kind(cursor, pos, doc_len, tag_prop, tag_value, memo)
+        if kind == "start":
+            end_inclusive = _scan_marked_run(cursor, pos, 1, doc_len, tag_prop, tag_value, memo)
+            return (pos, end_inclusive + 1)
+        if kind == "end":
+            start = _scan_marked_run(cursor, pos - 1, -1, doc_len, tag_prop, tag_value, memo)
+            return (start, pos)
 
         return None
     except Exception:
@@ -222,22 +561,58 @@ def _safe_set_cursor_position(doc: QTextDocument, cur: QTextCursor, p: int, wher
     except Exception as e:
         logger.debug("[cursor-setpos][py-exc] where=%s pos=%s doc_len=%s err=%s", where, p, _dl, e)
 
+def _batch_viewport_updates(handler):
+    """鼠标事件处理期间合并视口重绘请求：处理函数内的多次标记只在返回时触发一次 update()"""
+    @functools.wraps(handler)
+    def wrapper(self, event):
+        self._viewport_batch_depth += 1
+        try:
+            return handler(self, event)
+        finally:
+            self._viewport_batch_depth -= 1
+            if not self._viewport_batch_depth and self._viewport_dirty:
+                self._viewport_dirty = False
+                self.viewport().update()
+    return wrapper
+
+
 class PasteImageTextEdit(QTextEdit):
     """支持粘贴图片的文本编辑器"""
 
     # 附件整体的特殊标记：附件文本会被解析为若干字符
     # 我们用该标记覆盖"附件展示块"对应的文本范围，确保删除时按整体删除
-    ATTACHMENT_TAG_PREFIX = "__encnotes_attachment__"
-    ATTACHMENT_TAG_PROP = QTextFormat.Property.UserProperty + 1000
+    # 附件字符使用自定义 objectType 标记（普通文字的 objectType 不影响排版，只有 U+FFFC 才按对象绘制），
+    # 读取 objectType() 得到的是整数，不需要 QVariant 装箱/拆箱
+    ATTACHMENT_OBJECT_TYPE = QTextFormat.ObjectTypes.UserObject.value + 17
+    # 通用标记扫描函数按 (属性号, 属性值) 工作：属性号即 ObjectType，属性值即上面的对象类型
+    ATTACHMENT_TAG_PROP = _OBJECT_TYPE_PROP
     
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent_editor = parent
+        # 附件管理器在编辑器生命周期内不变，构造时解析一次（删除附件时使用）
+        self._attachment_manager = getattr(
+            getattr(parent, "note_manager", None), "attachment_manager", None
+        )
         self.setMouseTracking(True)
 
-        # 生成唯一tag名（避免不同编辑器实例冲突）
-        self._attachment_tag_name = f"{self.ATTACHMENT_TAG_PREFIX}{uuid.uuid4().hex}"
-        self._init_attachment_tag_style()
+        # 附件标记值：字符格式上存放的是附件 objectType（所有编辑器实例共用同一个值）
+        self._attachment_tag_id = self.ATTACHMENT_OBJECT_TYPE
+        
+        # 文档中带附件标记的片段数：为 0 时附件相关检查可直接跳过
+        # 新增内容时增量统计；有删除时只置脏，下次使用前再整篇重数
+        self._attachment_count: int = 0
+        self._attachment_count_dirty = False
+        self.document().contentsChange.connect(self._on_contents_change_attachments)
+        
+        # 链接范围索引：按起始位置排序的 (start, end, href)，文档变化后置空、点击时按需重建
+        self._anchor_index: list[tuple[int, int, str]] | None = None
+        self._anchor_starts: list[int] = []
+        self.document().contentsChange.connect(self._invalidate_anchor_index)
+        
+        # 图片字符索引：U+FFFC 图片字符位置 -> 图片格式，文档变化后置空、鼠标查找时按需重建
+        self._image_index: dict[int, QTextImageFormat] | None = None
+        self.document().contentsChange.connect(self._invalidate_image_index)
 
         
         # 图片选中和缩放相关
@@ -250,12 +625,16 @@ class PasteImageTextEdit(QTextEdit):
         self.resize_handle = None  # 'tl', 't', 'tr', 'r', 'br', 'b', 'bl', 'l'
         self.resize_start_pos = None
         self.resize_start_size = None
+        self._pending_resize_size = None  # 缩放拖动中待应用的 (宽, 高)，松开鼠标时写入文档
         
         # 拖动移动相关
         self.dragging = False
         self.drag_start_pos = None
         self.drag_start_cursor_pos = None
         self.drag_preview_cursor = None  # 拖动预览光标位置
+        # 拖动预览的距离+时间过滤：上次处理的位置及其计时
+        self._last_drag_pos = None
+        self._last_drag_timer = QElapsedTimer()
         
         # 文本选择相关
         self.text_selecting = False
@@ -269,40 +648,111 @@ class PasteImageTextEdit(QTextEdit):
         # 边界检测阈值
         self.handle_size = 8
         
+        # 鼠标移动节流：悬停时的图片/表格命中检测每个间隔最多做一次（缩放、拖动不节流）
+        self._move_throttle_ms = 12
+        self._pending_move_pos = None
+        self._move_throttle_timer = QTimer(self)
+        self._move_throttle_timer.setSingleShot(True)
+        self._move_throttle_timer.setInterval(self._move_throttle_ms)
+        self._move_throttle_timer.timeout.connect(self._flush_pending_move)
+        # 鼠标事件内合并的视口重绘请求（见 _batch_viewport_updates）
+        self._viewport_dirty = False
+        self._viewport_batch_depth = 0
+        # 附件选区扩展的增量缓存：上次处理的 (选区起点, 选区终点, 文档修订号) 及找到的附件范围
+        self._last_expand_key = (None, None, -1)
+        self._last_expand_bounds = None
+        # 悬停光标形状缓存：((x, y, 文档修订号, 滚动位置, 视口宽度), 光标形状)
+        self._hover_cache: tuple | None = None
+        self._handle_cache: tuple | None = None  # (几何参数, 控制点字典)
+        self._handle_rect_list: list[QRect] = []  # 与缓存同步的控制点列表，供 drawRects 使用
+        
+        # 逐字符探测用的复用光标（见 _scratch），避免每次调用都新建 QTextCursor
+        self._scratch_cursor: QTextCursor | None = None
+        self._scratch_doc = None
+        
+        # 图片矩形缓存：(位置, 文档修订号, 滚动位置, 视口宽度) -> QRect | None，FIFO 淘汰
+        self._img_rect_cache: dict[tuple[int, int, int, int, int], QRect | None] = {}
+        self._img_rect_cache_maxsize = 64
+        # 选中表格的矩形缓存：(键, QRectF | None)，只保留最近一次
+        self._table_rect_cache: tuple | None = None
+        
         # 监听滚动事件
         self.verticalScrollBar().valueChanged.connect(self.on_scroll)
         self.horizontalScrollBar().valueChanged.connect(self.on_scroll)
 
-    def _init_attachment_tag_style(self):
-        """初始化附件 tag 的样式（只用于标记范围，不改变显示）"""
-        try:
-            fmt = QTextCharFormat()
-            fmt.setProperty(self.ATTACHMENT_TAG_PROP, self._attachment_tag_name)
-            # 不改变前景/背景/字体等显示，仅作为范围标记
-            self.document().addResource(
-                QTextDocument.ResourceType.UserResource,
-                QUrl(self._attachment_tag_name),
-                QByteArray(),
+    def _scratch(self, doc: QTextDocument | None = None) -> QTextCursor:
+        """返回绑定到当前文档的复用光标（仅用于只读探测，调用方不要长期持有）
+
+        调用方已取得 self.document() 时可直接传入，省去一次查询。
+        """
+        if doc is None:
+            doc = self.document()
+        if self._scratch_cursor is None or self._scratch_doc is not doc:
+            # 文档被替换（setDocument）后重新创建
+            self._scratch_cursor = QTextCursor(doc)
+            self._scratch_doc = doc
+            # 缓存只在经过 _scratch 后才会写入，因此在这里为新文档挂上失效信号
+            self._img_rect_cache.clear()
+            doc.contentsChange.connect(self._invalidate_layout_caches)
+        return self._scratch_cursor
+
+    def _invalidate_layout_caches(self, *args):
+        """文档内容变化时清空图片/表格矩形缓存"""
+        self._img_rect_cache.clear()
+        self._table_rect_cache = None
+
+    def _char_format_at(self, pos: int, cur: QTextCursor | None = None) -> QTextCharFormat | None:
+        """获取 pos 处字符的格式（复用光标选中该字符）；pos 超出文档范围时返回None"""
+        if cur is None:
+            cur = self._scratch()
+        doc_len = cur.document().characterCount()
+        if doc_len <= 0 or pos < 0 or pos > doc_len - 1:
+            return None
+        if not _select_char_at(cur, pos):
+            return None
+        return cur.charFormat()
+
+    def _on_contents_change_attachments(self, position, chars_removed, chars_added):
+        """维护附件标记片段计数（打标记的 mergeCharFormat 也会触发该信号）"""
+        doc = self.document()
+        if chars_removed and self._attachment_count:
+            # 删除掉的内容已无法检查，是否删掉了附件只能整篇重数
+            self._attachment_count_dirty = True
+        if chars_added and not self._attachment_count_dirty:
+            self._attachment_count += _count_marked_fragments(
+                doc,
+                position,
+                position + chars_added,
+                self.ATTACHMENT_TAG_PROP,
+                self._attachment_tag_id,
             )
 
-        except Exception:
-            # 标记失败不应影响编辑器可用性
-            pass
+    def _has_attachments(self) -> bool:
+        """文档中是否存在带附件标记的内容"""
+        if self._attachment_count_dirty:
+            doc = self.document()
+            self._attachment_count = _count_marked_fragments(
+                doc, 0, doc.characterCount(), self.ATTACHMENT_TAG_PROP, self._attachment_tag_id
+            )
+            self._attachment_count_dirty = False
+        return self._attachment_count > 0
 
     def _cursor_is_in_attachment_block(self, cursor: QTextCursor) -> bool:
         """判断光标是否位于附件块的字符范围内（通过 charFormat 的 anchor 属性不可靠，所以用自定义 property 标识）"""
-        if not cursor:
+        if not cursor or not self._has_attachments():
             return False
 
-        # 若有选区，任一端点在附件内都视为在附件内
-        positions = [cursor.position()]
+        # 若有选区，任一端点在附件内都视为在附件内（position 必然等于其中一个端点）
+        positions = {cursor.position()}
         if cursor.hasSelection():
-            positions.append(cursor.selectionStart())
-            positions.append(cursor.selectionEnd())
+            positions.add(cursor.selectionStart())
+            positions.add(cursor.selectionEnd())
 
+        # 直接读取所在片段的 objectType（整数），不需要逐字符建立选区
         doc = self.document()
         for pos in positions:
-            if _is_marked_at(doc, pos, self.ATTACHMENT_TAG_PROP, self._attachment_tag_name):
+            frag = _fragment_at(doc, pos)
+            if frag is not None and frag.charFormat().objectType() == self.ATTACHMENT_OBJECT_TYPE:
                 return True
         return False
 
@@ -311,13 +761,13 @@ class PasteImageTextEdit(QTextEdit):
 
         这里的"找范围"逻辑统一复用 `_find_marked_span_around()`，确保与其他标记扫描一致。
         """
-        if not cursor:
+        if not cursor or not self._has_attachments():
             return None
 
         doc = self.document()
         pos = cursor.position()
         try:
-            span = _find_marked_span(doc, pos, self.ATTACHMENT_TAG_PROP, self._attachment_tag_name)
+            span = _find_marked_span(doc, pos, self.ATTACHMENT_TAG_PROP, self._attachment_tag_id)
             # if span is None and pos - 1 >= 0:
             #     span = _find_marked_span_around(doc, pos - 1, self.ATTACHMENT_TAG_PROP, tag_value)
         except Exception:
@@ -348,6 +798,9 @@ class PasteImageTextEdit(QTextEdit):
     def on_scroll(self):
 
         """滚动事件处理 - 更新边界框位置"""
+        # 旧滚动位置的矩形不会再命中，直接清空
+        self._img_rect_cache.clear()
+        self._table_rect_cache = None
         if self.selected_image and self.selected_image_cursor:
             # 重新计算图片位置
             self.selected_image_rect = self.get_image_rect_at_cursor(self.selected_image_cursor)
@@ -366,14 +819,33 @@ class PasteImageTextEdit(QTextEdit):
         if not table:
             return None
         
-        from PyQt6.QtCore import QRectF
-        from PyQt6.QtGui import QTextLength
-        
+        # 选中表格后每次重绘都会调用这里，布局未变化时直接复用上次结果
+        # 用表格起始位置而非 id(table) 标识表格：包装对象可能被回收复用
         try:
-            # 获取表格格式
             table_format = table.format()
             table_width_length = table_format.width()
-            
+            key = (
+                table.firstPosition(),
+                self.document().revision(),
+                self.viewport().width(),
+                self.verticalScrollBar().value(),
+                self.horizontalScrollBar().value(),
+                table_width_length.rawValue(),
+                table.rows(),
+                table.columns(),
+            )
+        except Exception:
+            return None
+        if self._table_rect_cache is not None and self._table_rect_cache[0] == key:
+            cached = self._table_rect_cache[1]
+            return QRectF(cached) if cached is not None else None
+        table_rect = self._compute_table_rect(table, table_format, table_width_length)
+        self._table_rect_cache = (key, table_rect)
+        return QRectF(table_rect) if table_rect is not None else None
+    
+    def _compute_table_rect(self, table, table_format, table_width_length):
+        """根据布局计算表格的边界框（视口坐标），失败返回 None"""
+        try:
             # 获取左上角单元格（第一行第一列）
             top_left_cell = table.cellAt(0, 0)
             if not top_left_cell.isValid():
@@ -488,10 +960,6 @@ class PasteImageTextEdit(QTextEdit):
             url_or_path: 可以是字符串路径或QUrl对象
         """
         try:
-            import subprocess
-            import platform
-            import tempfile
-            
             # 获取文件路径或附件ID
             if isinstance(url_or_path, str):
                 file_path = url_or_path
@@ -505,7 +973,6 @@ class PasteImageTextEdit(QTextEdit):
 
                 # 获取附件管理器
                 if not self.parent_editor or not self.parent_editor.note_manager:
-                    from PyQt6.QtWidgets import QMessageBox
                     QMessageBox.warning(self, "错误", "无法访问附件管理器")
                     return
 
@@ -522,11 +989,10 @@ class PasteImageTextEdit(QTextEdit):
                 # 使用AttachmentManager的新方法打开附件（自动管理临时文件）
                 success, message = attachment_manager.open_attachment_with_system(attachment_id)
                 if not success:
-                    from PyQt6.QtWidgets import QMessageBox
                     QMessageBox.warning(self, "打开失败", message)
                     return
 
-                print(f"打开加密附件: {message}")
+                logger.info("打开加密附件: %s", message)
                 return
             
             # 处理普通文件链接
@@ -536,118 +1002,116 @@ class PasteImageTextEdit(QTextEdit):
             
             # 检查文件是否存在
             if not os.path.exists(file_path):
-                from PyQt6.QtWidgets import QMessageBox
                 QMessageBox.warning(self, "文件不存在", f"无法找到文件：\n{file_path}")
                 return
             
             # 根据操作系统使用不同的命令打开文件
-            system = platform.system()
-            if system == 'Darwin':  # macOS
-                subprocess.run(['open', file_path])
-            elif system == 'Windows':
-                os.startfile(file_path)
-            elif system == 'Linux':
-                subprocess.run(['xdg-open', file_path])
+            open_file = _OPEN_FILE_HANDLERS.get(_PLATFORM)
+            if open_file is not None:
+                open_file(file_path)
             else:
-                from PyQt6.QtWidgets import QMessageBox
                 QMessageBox.warning(self, "不支持的系统", f"当前系统不支持自动打开文件")
                 
-            print(f"打开附件: {file_path}")
+            logger.info("打开附件: %s", file_path)
             
         except Exception as e:
-            from PyQt6.QtWidgets import QMessageBox
             QMessageBox.critical(self, "打开失败", f"无法打开文件：\n{str(e)}")
-            print(f"打开附件失败: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("打开附件失败: %s", e)
     
     def paintEvent(self, event):
         """绘制事件 - 绘制选中图片的边界框"""
         super().paintEvent(event)
         
-        # 绘制选中表格的边界框和全选图标
-        if self.selected_table and self.selected_table_cursor:
-            from PyQt6.QtGui import QPainter, QPen, QBrush
-            from PyQt6.QtCore import QRectF, QRect
-            
-            painter = QPainter(self.viewport())
-            
-            # 计算表格的实际边界框
-            table_rect = self.get_table_rect(self.selected_table)
-            
-            if table_rect:
-                # 只绘制边框，不绘制角标
-                # 绘制蓝色边界框
-                pen = QPen(QColor("#007AFF"), 3)
-                painter.setPen(pen)
-                painter.drawRect(table_rect)
-            
-            painter.end()
+        # 没有任何需要叠加绘制的内容时直接返回（普通输入时的光标闪烁重绘走这里）
+        selected_table = self.selected_table
+        image_cursor = self.selected_image_cursor
+        preview_cursor = self.drag_preview_cursor
+        draw_table = bool(selected_table and self.selected_table_cursor)
+        draw_image = bool(self.selected_image and image_cursor)
+        draw_drag = bool(self.dragging and preview_cursor)
+        if not (draw_table or draw_image or draw_drag):
+            return
         
-        if self.selected_image and self.selected_image_cursor:
-            # 实时计算图片位置（确保滚动时位置正确）
-            self.selected_image_rect = self.get_image_rect_at_cursor(self.selected_image_cursor)
+        # 多种叠加内容同时存在时也只创建一个 QPainter
+        painter = QPainter(self.viewport())
+        try:
+            # 绘制选中表格的边界框和全选图标
+            if draw_table:
+                # 计算表格的实际边界框
+                table_rect = self.get_table_rect(selected_table)
+                
+                if table_rect:
+                    # 只绘制边框，不绘制角标
+                    # 绘制蓝色边界框
+                    pen = QPen(QColor("#007AFF"), 3)
+                    painter.setPen(pen)
+                    painter.drawRect(table_rect)
             
-            if self.selected_image_rect:
-                from PyQt6.QtGui import QPainter, QPen
+            if draw_image:
+                # 实时计算图片位置（确保滚动时位置正确）
+                image_rect = self.get_image_rect_at_cursor(image_cursor)
+                self.selected_image_rect = image_rect
                 
-                painter = QPainter(self.viewport())
+                if image_rect:
+                    # 绘制边界框
+                    pen = QPen(QColor("#007AFF"), 2)
+                    painter.setPen(pen)
+                    painter.setBrush(Qt.BrushStyle.NoBrush)
+                    painter.drawRect(image_rect)
+                    
+                    # 绘制8个控制点（一次性批量绘制）
+                    self.get_resize_handles()
+                    painter.setBrush(QColor("#007AFF"))
+                    painter.drawRects(self._handle_rect_list)
+                    
+                    # 缩放拖动中：用虚线框预览新尺寸，松开鼠标时才真正修改文档
+                    pending_size = self._pending_resize_size
+                    if pending_size:
+                        pen = QPen(QColor("#007AFF"), 1)
+                        pen.setStyle(Qt.PenStyle.DashLine)
+                        painter.setPen(pen)
+                        painter.setBrush(Qt.BrushStyle.NoBrush)
+                        painter.drawRect(QRect(
+                            image_rect.left(), image_rect.top(),
+                            int(pending_size[0]), int(pending_size[1]),
+                        ))
+            
+            # 绘制拖动预览指示器
+            if draw_drag:
+                # 获取预览位置的光标矩形
+                preview_rect = self.cursorRect(preview_cursor)
                 
-                # 绘制边界框
+                # 绘制一条垂直的蓝色虚线，表示图片将被插入的位置
                 pen = QPen(QColor("#007AFF"), 2)
+                pen.setStyle(Qt.PenStyle.DashLine)
                 painter.setPen(pen)
-                painter.drawRect(self.selected_image_rect)
                 
-                # 绘制8个控制点
-                handles = self.get_resize_handles()
-                painter.setBrush(QColor("#007AFF"))
-                for handle_rect in handles.values():
-                    painter.drawRect(handle_rect)
+                # 绘制插入位置指示线
+                x = preview_rect.left()
+                y_start = preview_rect.top() - 5
+                y_end = preview_rect.bottom() + 5
                 
-                painter.end()
-        
-        # 绘制拖动预览指示器
-        if self.dragging and self.drag_preview_cursor:
-            from PyQt6.QtGui import QPainter, QPen
-            from PyQt6.QtCore import QPoint
-            
-            painter = QPainter(self.viewport())
-            
-            # 获取预览位置的光标矩形
-            preview_rect = self.cursorRect(self.drag_preview_cursor)
-            
-            # 绘制一条垂直的蓝色虚线，表示图片将被插入的位置
-            pen = QPen(QColor("#007AFF"), 2)
-            pen.setStyle(Qt.PenStyle.DashLine)
-            painter.setPen(pen)
-            
-            # 绘制插入位置指示线
-            x = preview_rect.left()
-            y_start = preview_rect.top() - 5
-            y_end = preview_rect.bottom() + 5
-            
-            painter.drawLine(QPoint(x, y_start), QPoint(x, y_end))
-            
-            # 在指示线两端绘制小三角形
-            from PyQt6.QtGui import QPolygon
-            
-            # 上三角
-            top_triangle = QPolygon([
-                QPoint(x, y_start),
-                QPoint(x - 4, y_start - 6),
-                QPoint(x + 4, y_start - 6)
-            ])
-            painter.setBrush(QColor("#007AFF"))
-            painter.drawPolygon(top_triangle)
-            
-            # 下三角
-            bottom_triangle = QPolygon([
-                QPoint(x, y_end),
-                QPoint(x - 4, y_end + 6),
-                QPoint(x + 4, y_end + 6)
-            ])
-            painter.drawPolygon(bottom_triangle)
-            
+                painter.drawLine(QPoint(x, y_start), QPoint(x, y_end))
+                
+                # 在指示线两端绘制小三角形（两个三角形合成一条路径，一次绘制）
+                triangles = QPainterPath()
+                # 上三角
+                triangles.addPolygon(QPolygonF([
+                    QPointF(x, y_start),
+                    QPointF(x - 4, y_start - 6),
+                    QPointF(x + 4, y_start - 6)
+                ]))
+                triangles.closeSubpath()
+                # 下三角
+                triangles.addPolygon(QPolygonF([
+                    QPointF(x, y_end),
+                    QPointF(x - 4, y_end + 6),
+                    QPointF(x + 4, y_end + 6)
+                ]))
+                triangles.closeSubpath()
+                painter.setBrush(QColor("#007AFF"))
+                painter.drawPath(triangles)
+        finally:
             painter.end()
     
     def get_resize_handles(self):
@@ -655,11 +1119,14 @@ class PasteImageTextEdit(QTextEdit):
         if not self.selected_image_rect:
             return {}
         
-        from PyQt6.QtCore import QRect
-        
         rect = self.selected_image_rect
         hs = self.handle_size
         
+        # 重绘/鼠标移动时矩形通常不变，按几何参数缓存（矩形被替换或修改后键自然失效）
+        key = (rect.left(), rect.top(), rect.width(), rect.height(), hs)
+        if self._handle_cache is not None and self._handle_cache[0] == key:
+            return self._handle_cache[1]
+        
         handles = {
             'tl': QRect(rect.left() - hs//2, rect.top() - hs//2, hs, hs),
             't': QRect(rect.center().x() - hs//2, rect.top() - hs//2, hs, hs),
@@ -671,6 +1138,8 @@ class PasteImageTextEdit(QTextEdit):
             'l': QRect(rect.left() - hs//2, rect.center().y() - hs//2, hs, hs),
         }
         
+        self._handle_cache = (key, handles)
+        self._handle_rect_list = list(handles.values())
         return handles
     
     def get_handle_at_pos(self, pos):
@@ -704,37 +1173,37 @@ class PasteImageTextEdit(QTextEdit):
         Returns:
             tuple: (image_format, image_cursor, image_rect) 如果找到图片，否则返回 (None, None, None)
         """
-        # 遍历文档中的所有字符，查找图片
-        cursor = QTextCursor(self.document())
-        cursor.movePosition(QTextCursor.MoveOperation.Start)
-        
-        while not cursor.atEnd():
-            # 保存当前位置（图片字符的起始位置）
-            current_pos = cursor.position()
-            
-            # 检查当前位置的字符格式
-            # 注意：需要先向右移动一个字符，再检查格式
-            _select_char_at(cursor, cursor.position())
-            char_format = cursor.charFormat()
-            selected_text = cursor.selectedText()
-            
-            # **关键修复**：只检测真正的图片字符（U+FFFC），忽略段落分隔符（U+2029）
-            if char_format.isImageFormat() and selected_text == '\ufffc':
-                # 找到一个真正的图片字符
-                # 创建一个新光标，指向图片字符的起始位置
-                image_cursor = QTextCursor(self.document())
-                image_cursor.setPosition(current_pos)
-                
-                # 计算图片的矩形区域
-                img_format = char_format.toImageFormat()
-                img_rect = self.get_image_rect_at_cursor(image_cursor)
-                
-                # 检查鼠标位置是否在这个图片的矩形内
-                if img_rect and img_rect.contains(pos):
-                    return (img_format, image_cursor, img_rect)
-            
-            # 清除选区，移动到下一个字符
-            cursor.clearSelection()
+        # 文档中没有图片时无需做命中测试（悬停时每次移动都会调用这里）
+        if self._image_index is None:
+            self._build_image_index()
+        image_index = self._image_index
+        if not image_index:
+            return (None, None, None)
+        
+        # 由文档布局直接定位鼠标下的字符位置（文档坐标 = 视口坐标 + 滚动偏移）
+        doc = self.document()
+        doc_point = QPointF(
+            pos.x() + self.horizontalScrollBar().value(),
+            pos.y() + self.verticalScrollBar().value(),
+        )
+        hit_pos = doc.documentLayout().hitTest(doc_point, Qt.HitTestAccuracy.ExactHit)
+        if hit_pos < 0:
+            return (None, None, None)
+        
+        # hitTest 返回的是光标位置：点在图片右半边时落在图片之后，所以前后两个字符都要看
+        probe = self._scratch(doc)
+        for image_pos in (hit_pos, hit_pos - 1):
+            image_format = image_index.get(image_pos)
+            if image_format is None:
+                continue
+            probe.setPosition(image_pos)
+            img_rect = self.get_image_rect_at_cursor(probe)
+            if img_rect and img_rect.contains(pos):
+                # 命中后才为调用方创建独立的光标
+                image_cursor = QTextCursor(doc)
+                image_cursor.setPosition(image_pos)
+                # 返回格式副本，调用方修改选中图片的格式不会影响索引
+                return (QTextImageFormat(image_format), image_cursor, img_rect)
         
         return (None, None, None)
     
@@ -747,11 +1216,33 @@ class PasteImageTextEdit(QTextEdit):
         Returns:
             QRect: 图片的矩形区域，如果不是图片则返回None
         """
-        # 创建一个光标副本，避免修改原光标
-        temp_cursor = QTextCursor(cursor)
-        
+        # 使用复用光标探测，避免修改原光标（cursor 本身也可能就是复用光标）
+        image_pos = cursor.position()
+        doc = self.document()
+        temp_cursor = self._scratch(doc)
+        
+        # 选中图片后每次重绘都会调用这里，布局未变化时直接复用上次结果
+        cache = self._img_rect_cache
+        key = (
+            image_pos,
+            doc.revision(),
+            self.verticalScrollBar().value(),
+            self.horizontalScrollBar().value(),
+            self.viewport().width(),
+        )
+        if key in cache:
+            cached = cache[key]
+            return QRect(cached) if cached is not None else None
+        result_rect = self._compute_image_rect(temp_cursor, image_pos)
+        if len(cache) >= self._img_rect_cache_maxsize:
+            del cache[next(iter(cache))]
+        cache[key] = result_rect
+        return QRect(result_rect) if result_rect is not None else None
+    
+    def _compute_image_rect(self, temp_cursor, image_pos):
+        """根据布局计算 image_pos 处图片的矩形（视口坐标），不是图片则返回 None"""
         # 向右移动一个字符并选中，这样charFormat()才能返回图片字符的格式
-        _select_char_at(temp_cursor, temp_cursor.position())
+        _select_char_at(temp_cursor, image_pos)
         char_format = temp_cursor.charFormat()
         
         if not char_format.isImageFormat():
@@ -762,13 +1253,11 @@ class PasteImageTextEdit(QTextEdit):
         width = img_format.width()
         height = img_format.height()
         
-        # 创建一个新光标，指向图片字符的起始位置
-        image_cursor = QTextCursor(cursor)
+        # 指向图片字符的起始位置
+        temp_cursor.setPosition(image_pos)
         
         # 获取图片字符的光标矩形
-        cursor_rect = self.cursorRect(image_cursor)
-        
-        from PyQt6.QtCore import QRect
+        cursor_rect = self.cursorRect(temp_cursor)
         
         # 图片的左边界是光标的左边界
         image_left = cursor_rect.left()
@@ -780,9 +1269,8 @@ class PasteImageTextEdit(QTextEdit):
         
         # 方法：向右移动光标到图片之后，获取该位置的光标矩形
         # 图片之后的光标矩形的 bottom() 就是图片底部的位置
-        temp_cursor2 = QTextCursor(image_cursor)
-        temp_cursor2.movePosition(QTextCursor.MoveOperation.Right)
-        cursor_rect_after = self.cursorRect(temp_cursor2)
+        temp_cursor.movePosition(QTextCursor.MoveOperation.Right)
+        cursor_rect_after = self.cursorRect(temp_cursor)
         
         # 图片底部 = 图片之后光标的底部
         image_bottom = cursor_rect_after.bottom()
@@ -859,14 +1347,86 @@ class PasteImageTextEdit(QTextEdit):
         char_fmt.setFontWeight(QFont.Weight.Bold)  # 粗体
         self.setCurrentCharFormat(char_fmt)
 
+    def _invalidate_anchor_index(self, *args):
+        """文档内容变化后链接索引失效"""
+        self._anchor_index = None
+
+    def _build_anchor_index(self):
+        """遍历块/片段，收集所有带链接的片段范围"""
+        index = []
+        block = self.document().firstBlock()
+        while block.isValid():
+            it = block.begin()
+            while not it.atEnd():
+                frag = it.fragment()
+                if frag.isValid():
+                    href = frag.charFormat().anchorHref()
+                    if href:
+                        start = frag.position()
+                        index.append((start, start + frag.length(), href))
+                it += 1
+            block = block.next()
+        # 表格单元格中的块按文档位置排列，这里排序只是保险
+        index.sort()
+        self._anchor_index = index
+        self._anchor_starts = [start for start, _, _ in index]
+
+    def _invalidate_image_index(self, *args):
+        """文档内容或格式变化后图片索引失效"""
+        self._image_index = None
+
+    def _build_image_index(self):
+        """遍历块/片段，收集所有图片字符（U+FFFC）的位置和图片格式"""
+        index = {}
+        block = self.document().firstBlock()
+        while block.isValid():
+            it = block.begin()
+            while not it.atEnd():
+                frag = it.fragment()
+                if frag.isValid():
+                    char_format = frag.charFormat()
+                    if char_format.isImageFormat():
+                        # 相同格式的相邻图片可能合并在同一片段里，逐个记录
+                        start = frag.position()
+                        image_format = char_format.toImageFormat()
+                        for offset, ch in enumerate(frag.text()):
+                            if ch == '\ufffc':
+                                index[start + offset] = image_format
+                it += 1
+            block = block.next()
+        self._image_index = index
+
+    def _anchor_href_at(self, pos) -> str:
+        """返回视口坐标 pos 处字符所在的链接地址（与 anchorAt 相同：按字符精确命中）"""
+        if self._anchor_index is None:
+            self._build_anchor_index()
+        if not self._anchor_index:
+            return ""
+        doc_point = QPointF(
+            pos.x() + self.horizontalScrollBar().value(),
+            pos.y() + self.verticalScrollBar().value(),
+        )
+        hit = self.document().documentLayout().hitTest(doc_point, Qt.HitTestAccuracy.ExactHit)
+        if hit < 0:
+            return ""
+        i = bisect.bisect_right(self._anchor_starts, hit) - 1
+        if i >= 0:
+            start, end, href = self._anchor_index[i]
+            if start <= hit < end:
+                return href
+        return ""
+
     def _handle_anchor_click(self, event) -> bool:
         """处理附件链接点击
 
         Returns:
             如果处理了链接点击返回True，否则返回False
         """
-        # 使用 anchorAt 方法精确判断是否点击在链接上
-        anchor_href = self.anchorAt(event.pos())
+        # 通过链接索引判断是否点击在链接上；索引不可用时退回 anchorAt
+        try:
+            anchor_href = self._anchor_href_at(event.pos())
+        except Exception:
+            anchor_href = self.anchorAt(event.pos())
         if anchor_href:
             self.open_attachment(anchor_href)
             event.accept()
@@ -915,7 +1475,7 @@ class PasteImageTextEdit(QTextEdit):
         clear_cursor.setPosition(table_end + 1)
         self.setTextCursor(clear_cursor)
         
-        self.viewport().update()
+        self._mark_viewport_dirty()
         event.accept()
         return True
 
@@ -924,6 +1484,13 @@ class PasteImageTextEdit(QTextEdit):
         if self.selected_table:
             self.selected_table = None
             self.selected_table_cursor = None
+            self._mark_viewport_dirty()
+
+    def _mark_viewport_dirty(self):
+        """请求重绘视口：在鼠标事件处理中只做标记，由事件结束时统一 update()"""
+        if self._viewport_batch_depth:
+            self._viewport_dirty = True
+        else:
             self.viewport().update()
 
     def _clear_table_selection(self):
@@ -931,7 +1498,7 @@ class PasteImageTextEdit(QTextEdit):
         if self.selected_table:
             self.selected_table = None
             self.selected_table_cursor = None
-            self.viewport().update()
+            self._mark_viewport_dirty()
 
     def _handle_image_resize_handle_click(self, event) -> bool:
         """处理图片缩放控制点点击
@@ -968,58 +1535,26 @@ class PasteImageTextEdit(QTextEdit):
             self.dragging = True
             self.drag_start_pos = event.pos()
             self.drag_start_cursor_pos = self.selected_image_cursor.position()
+            self._last_drag_pos = None
             event.accept()
             return True
         return False
 
-    def _find_real_image_char_position(self, image_cursor) -> int | None:
-        """查找真正的图片字符位置（跳过段落分隔符）
-        
-        Args:
-            image_cursor: 指向图片附近的光标
-            
-        Returns:
-            图片字符的位置，如果找不到返回None
-        """
-        cursor = QTextCursor(image_cursor)
-        
-        # 从当前位置开始，向右查找最多2个字符，找到真正的图片字符
-        for offset in range(2):
-            check_pos = image_cursor.position() + offset
-            cursor.setPosition(check_pos)
-            
-            # 向右移动一个字符并选中
-            if _select_char_at(cursor, check_pos):
-                selected_text = cursor.selectedText()
-                char_format = cursor.charFormat()
-                
-                # 检查是否是真正的图片字符
-                if char_format.isImageFormat() and selected_text == '\ufffc':
-                    return check_pos
-            
-            # 清除选区，继续查找
-            cursor.clearSelection()
-        
-        return None
-
     def _select_image_char(self, image_cursor):
-        """选中图片字符（用于删除等操作）
+        """选中真正的图片字符（跳过段落分隔符，用于删除等操作）
         
         Args:
             image_cursor: 指向图片附近的光标
         """
-        cursor = QTextCursor(image_cursor)
-        real_image_pos = self._find_real_image_char_position(image_cursor)
+        # 从当前位置开始，向右查找最多2个字符，找到真正的图片字符（U+FFFC）
+        start_pos = image_cursor.position()
+        found = self._find_image_char_near(start_pos)
+        target_pos = found[0] if found else start_pos
         
-        if real_image_pos is not None:
-            # 选中真正的图片字符
-            _select_char_at(cursor, real_image_pos)
-            self.setTextCursor(cursor)
-        else:
-            # 如果找不到真正的图片字符，使用原来的逻辑
-            cursor = QTextCursor(image_cursor)
-            _select_char_at(cursor, cursor.position())
-            self.setTextCursor(cursor)
+        # 找不到时退回原位置；只用一个光标、只设置一次
+        cursor = QTextCursor(image_cursor)
+        _select_char_at(cursor, target_pos)
+        self.setTextCursor(cursor)
 
     def _handle_image_click(self, event) -> bool:
         """处理图片点击（选中图片）
@@ -1042,7 +1577,7 @@ class PasteImageTextEdit(QTextEdit):
             # 我们需要找到真正的图片字符并选中它
             self._select_image_char(image_cursor)
             
-            self.viewport().update()
+            self._mark_viewport_dirty()
             event.accept()
             return True
         return False
@@ -1053,13 +1588,16 @@ class PasteImageTextEdit(QTextEdit):
             self.selected_image = None
             self.selected_image_rect = None
             self.selected_image_cursor = None
-            self.viewport().update()
+            self._mark_viewport_dirty()
 
+    @_batch_viewport_updates
     def mousePressEvent(self, event):
         """鼠标按下事件"""
-        button_name = event.button().name if hasattr(event.button(), 'name') else str(event.button())
-        pos = event.pos()
-        logger.debug(f"[mousePressEvent] 鼠标按下事件触发 - 按钮: {button_name}, 位置: ({pos.x()}, {pos.y()})")
+        if logger.isEnabledFor(logging.DEBUG):
+            button = event.button()
+            button_name = button.name if hasattr(button, 'name') else str(button)
+            pos = event.pos()
+            logger.debug(f"[mousePressEvent] 鼠标按下事件触发 - 按钮: {button_name}, 位置: ({pos.x()}, {pos.y()})")
         
         # 检查是否应该忽略事件
         if self._should_ignore_mouse_event():
@@ -1067,55 +1605,61 @@ class PasteImageTextEdit(QTextEdit):
             event.ignore()
             return
         
+        # 非左键（右键菜单、中键粘贴等）：不涉及链接/表格/图片的点击处理，直接交给默认行为
+        if event.button() != Qt.MouseButton.LeftButton:
+            self._restore_cursor_visibility()
+            super().mousePressEvent(event)
+            # 中键粘贴可能移动光标，仍需检查标题行格式
+            self._restore_title_format_if_needed()
+            return
+        
         # 标记鼠标已按下
-        if event.button() == Qt.MouseButton.LeftButton:
-            self.mouse_pressed = True
-            logger.debug("[mousePressEvent] 标记鼠标左键已按下")
+        self.mouse_pressed = True
+        logger.debug("[mousePressEvent] 标记鼠标左键已按下")
         
         # 恢复光标显示
         self._restore_cursor_visibility()
         
-        if event.button() == Qt.MouseButton.LeftButton:
-            # 首先检查是否点击了链接（附件）
-            if self._handle_anchor_click(event):
-                logger.debug("[mousePressEvent] 处理链接点击，事件结束")
-                return
-            
-            # 检查是否点击了表格
-            cursor = self.cursorForPosition(event.pos())
-            table = cursor.currentTable()
-            if table:
-                logger.debug("[mousePressEvent] 点击了表格区域")
-                # 检查是否点击了表格边框
-                if self._handle_table_border_click(table, cursor, event):
-                    logger.debug("[mousePressEvent] 处理表格边框点击，事件结束")
-                    return
-                # 点击了表格内容区域，取消表格选中，进入编辑模式
-                logger.debug("[mousePressEvent] 处理表格内容点击")
-                self._handle_table_content_click(event)
-                # 使用默认行为，进入单元格编辑模式
-                super().mousePressEvent(event)
+        # 首先检查是否点击了链接（附件）
+        if self._handle_anchor_click(event):
+            logger.debug("[mousePressEvent] 处理链接点击，事件结束")
+            return
+        
+        # 检查是否点击了表格
+        cursor = self.cursorForPosition(event.pos())
+        table = cursor.currentTable()
+        if table:
+            logger.debug("[mousePressEvent] 点击了表格区域")
+            # 检查是否点击了表格边框
+            if self._handle_table_border_click(table, cursor, event):
+                logger.debug("[mousePressEvent] 处理表格边框点击，事件结束")
                 return
-            # 取消表格选中
-            self._clear_table_selection()
+            # 点击了表格内容区域，取消表格选中，进入编辑模式
+            logger.debug("[mousePressEvent] 处理表格内容点击")
+            self._handle_table_content_click(event)
+            # 使用默认行为，进入单元格编辑模式
+            super().mousePressEvent(event)
+            return
+        # 取消表格选中
+        self._clear_table_selection()
 
-            # 检查是否点击了图片缩放控制点
-            if self._handle_image_resize_handle_click(event):
-                logger.debug("[mousePressEvent] 处理图片缩放控制点点击，事件结束")
-                return
-            
-            # 检查是否点击了图片中心区域（用于拖动移动）
-            if self._handle_image_drag_click(event):
-                logger.debug("[mousePressEvent] 处理图片拖动点击，事件结束")
-                return
-            
-            # 检查是否点击了图片
-            if self._handle_image_click(event):
-                logger.debug("[mousePressEvent] 处理图片点击，事件结束")
-                return
-            # 取消图片选中
-            self._clear_image_selection()
-            logger.debug("[mousePressEvent] 点击了普通文本区域")
+        # 检查是否点击了图片缩放控制点
+        if self._handle_image_resize_handle_click(event):
+            logger.debug("[mousePressEvent] 处理图片缩放控制点点击，事件结束")
+            return
+        
+        # 检查是否点击了图片中心区域（用于拖动移动）
+        if self._handle_image_drag_click(event):
+            logger.debug("[mousePressEvent] 处理图片拖动点击，事件结束")
+            return
+        
+        # 检查是否点击了图片
+        if self._handle_image_click(event):
+            logger.debug("[mousePressEvent] 处理图片点击，事件结束")
+            return
+        # 取消图片选中
+        self._clear_image_selection()
+        logger.debug("[mousePressEvent] 点击了普通文本区域")
 
         super().mousePressEvent(event)
         
@@ -1135,32 +1679,25 @@ class PasteImageTextEdit(QTextEdit):
         # 计算偏移量
         delta = event.pos() - self.resize_start_pos
         
-        # 根据控制点计算新的尺寸
-        new_width = self.resize_start_size[0]
-        new_height = self.resize_start_size[1]
-        aspect_ratio = self.resize_start_size[0] / self.resize_start_size[1]
-        
-        if self.resize_handle in ['tl', 'l', 'bl']:
-            # 左侧控制点：减小宽度
-            new_width = max(50, self.resize_start_size[0] - delta.x())
-        elif self.resize_handle in ['tr', 'r', 'br']:
-            # 右侧控制点：增加宽度
-            new_width = max(50, self.resize_start_size[0] + delta.x())
-        
-        if self.resize_handle in ['tl', 't', 'tr']:
-            # 顶部控制点：减小高度
-            new_height = max(50, self.resize_start_size[1] - delta.y())
-        elif self.resize_handle in ['bl', 'b', 'br']:
-            # 底部控制点：增加高度
-            new_height = max(50, self.resize_start_size[1] + delta.y())
+        # 根据控制点计算新的尺寸：左/上侧控制点反向（减小），右/下侧正向（增加），中间方向不变
+        start_width, start_height = self.resize_start_size
+        new_width = start_width
+        new_height = start_height
+        aspect_ratio = start_width / start_height
+        
+        dx_sign, dy_sign = _HANDLE_DELTAS[self.resize_handle]
+        if dx_sign:
+            new_width = max(50, start_width + dx_sign * delta.x())
+        if dy_sign:
+            new_height = max(50, start_height + dy_sign * delta.y())
         
         # 角落控制点：保持宽高比
-        if self.resize_handle in ['tl', 'tr', 'bl', 'br']:
+        if self.resize_handle in _CORNER_HANDLES:
             # 以宽度为准，计算高度
             new_height = int(new_width / aspect_ratio)
         
-        # 更新图片
-        self.update_image_size(new_width, new_height)
+        # 拖动过程中只预览，松开鼠标时一次性更新图片
+        self._preview_image_size(new_width, new_height)
         
         event.accept()
         return True
@@ -1174,49 +1711,81 @@ class PasteImageTextEdit(QTextEdit):
         if not (self.dragging and self.drag_start_pos):
             return False
         
-        # 更新预览光标位置
+        # 距上次处理移动不足 2 像素且不足 8 毫秒时跳过（cursorForPosition 代价较高）
         target_pos = event.pos()
+        last_pos = self._last_drag_pos
+        if (
+            last_pos is not None
+            and (target_pos - last_pos).manhattanLength() < 2
+            and self._last_drag_timer.elapsed() < 8
+        ):
+            event.accept()
+            return True
+        self._last_drag_pos = target_pos
+        self._last_drag_timer.restart()
+        
+        # 更新预览光标位置
         self.drag_preview_cursor = self.cursorForPosition(target_pos)
         
         # 更新光标形状
-        self.viewport().setCursor(Qt.CursorShape.ClosedHandCursor)
+        self._set_viewport_cursor(Qt.CursorShape.ClosedHandCursor)
         
         # 触发重绘以显示预览指示器
-        self.viewport().update()
+        self._mark_viewport_dirty()
         
         event.accept()
         return True
 
-    def _update_cursor_for_selected_image(self, event):
+    def _set_viewport_cursor(self, shape):
+        """设置视口光标形状；形状未变化时跳过（鼠标移动时绝大多数情况如此）"""
+        viewport = self.viewport()
+        # 与视口当前实际形状比较，Qt 自身改动过光标时也能正确恢复
+        if viewport.cursor().shape() != shape:
+            viewport.setCursor(shape)
+
+    def _update_cursor_for_selected_image(self, pos):
         """更新已选中图片的光标形状"""
-        handle = self.get_handle_at_pos(event.pos())
+        handle = self.get_handle_at_pos(pos)
         if handle:
-            self.viewport().setCursor(self.get_cursor_for_handle(handle))
+            self._set_viewport_cursor(self.get_cursor_for_handle(handle))
         else:
             # 检查是否在图片区域内
-            if self.selected_image_rect and self.selected_image_rect.contains(event.pos()):
-                self.viewport().setCursor(Qt.CursorShape.SizeAllCursor)
+            if self.selected_image_rect and self.selected_image_rect.contains(pos):
+                self._set_viewport_cursor(Qt.CursorShape.SizeAllCursor)
             else:
-                self.viewport().setCursor(Qt.CursorShape.IBeamCursor)
+                self._set_viewport_cursor(Qt.CursorShape.IBeamCursor)
 
-    def _update_cursor_for_hover(self, event):
+    def _update_cursor_for_hover(self, pos):
         """更新鼠标悬停时的光标形状（未选中图片时）"""
+        # 同一像素、同一文档修订号、滚动位置和视口宽度下结果不变，直接复用上次的判断
+        key = (
+            pos.x(),
+            pos.y(),
+            self.document().revision(),
+            self.verticalScrollBar().value(),
+            self.horizontalScrollBar().value(),
+            self.viewport().width(),
+        )
+        if self._hover_cache is not None and self._hover_cache[0] == key:
+            shape = self._hover_cache[1]
+        else:
+            shape = self._hover_cursor_shape(pos)
+            self._hover_cache = (key, shape)
+        self._set_viewport_cursor(shape)
+
+    def _hover_cursor_shape(self, pos):
+        """计算鼠标悬停位置应使用的光标形状"""
         # 检查是否悬停在图片上（使用像素位置检测）
-        image_format, _, _ = self.find_image_at_position(event.pos())
+        image_format, _, _ = self.find_image_at_position(pos)
         if image_format:
-            self.viewport().setCursor(Qt.CursorShape.PointingHandCursor)
-        else:
-            # 检查是否悬停在表格上
-            cursor = self.cursorForPosition(event.pos())
-            table = cursor.currentTable()
-            if table:
-                # 检查是否悬停在表格边框上
-                if self.is_click_on_table_border(event.pos(), table):
-                    self.viewport().setCursor(Qt.CursorShape.PointingHandCursor)
-                else:
-                    self.viewport().setCursor(Qt.CursorShape.IBeamCursor)
-            else:
-                self.viewport().setCursor(Qt.CursorShape.IBeamCursor)
+            return Qt.CursorShape.PointingHandCursor
+        # 检查是否悬停在表格上
+        cursor = self.cursorForPosition(pos)
+        table = cursor.currentTable()
+        if table and self.is_click_on_table_border(pos, table):
+            # 悬停在表格边框上
+            return Qt.CursorShape.PointingHandCursor
+        return Qt.CursorShape.IBeamCursor
 
     def _handle_text_selection_for_attachments(self):
         """处理文本选择时的附件扩展"""
@@ -1228,6 +1797,7 @@ class PasteImageTextEdit(QTextEdit):
         if cursor.hasSelection():
             self._expand_selection_for_attachments(cursor)
 
+    @_batch_viewport_updates
     def mouseMoveEvent(self, event):
         """鼠标移动事件"""
         # 处理图片缩放
@@ -1238,11 +1808,12 @@ class PasteImageTextEdit(QTextEdit):
         if self._handle_image_dragging(event):
             return
         
-        # 更新光标形状
-        if self.selected_image:
-            self._update_cursor_for_selected_image(event)
+        # 更新光标形状（节流：首个事件立即处理，间隔内的后续事件只保留最后位置）
+        if self._move_throttle_timer.isActive():
+            self._pending_move_pos = event.pos()
         else:
-            self._update_cursor_for_hover(event)
+            self._update_move_cursor(event.pos())
+            self._move_throttle_timer.start()
         
         # 调用父类方法处理默认的文本选择行为
         super().mouseMoveEvent(event)
@@ -1250,26 +1821,29 @@ class PasteImageTextEdit(QTextEdit):
         # 处理附件选择：在拖动过程中实时扩展选择范围
         self._handle_text_selection_for_attachments()
 
-    def _get_check_positions(self, sel_start: int, sel_end: int) -> list:
-        """生成需要检查的位置列表
-        Args:
-            sel_start: 选择起始位置
-            sel_end: 选择结束位置
-            
-        Returns:
-            需要检查的位置列表
-        """
-        check_positions = [sel_start]
-        for i in range(sel_start, sel_end):
-            check_positions.append(i)
+    def _update_move_cursor(self, pos):
+        """根据鼠标位置更新光标形状"""
+        if self.selected_image:
+            self._update_cursor_for_selected_image(pos)
+        else:
+            self._update_cursor_for_hover(pos)
 
-        return check_positions
-    
-    def _find_attachment_bounds(self, doc: QTextDocument, check_positions: list, tag_value: str) -> tuple:
-        """查找所有附件的边界范围
+    def _flush_pending_move(self):
+        """节流间隔结束：用最后一次移动的位置补做光标形状更新，保证停下时光标正确"""
+        pos = self._pending_move_pos
+        if pos is None:
+            return
+        self._pending_move_pos = None
+        self._update_move_cursor(pos)
+        # 仍在持续移动时开启下一个节流间隔
+        self._move_throttle_timer.start()
+
+    def _find_attachment_bounds(self, doc: QTextDocument, sel_start: int, sel_end: int, tag_value: int) -> tuple:
+        """查找与选择范围相交的所有附件的边界范围
         Args:
             doc: 文档对象
-            check_positions: 需要检查的位置列表
+            sel_start: 选择起始位置
+            sel_end: 选择结束位置（不包含）
             tag_value: 附件标签值
             
         Returns:
@@ -1278,25 +1852,39 @@ class PasteImageTextEdit(QTextEdit):
         min_start = None
         max_end = None
         
-        for pos in check_positions:
-            if pos < 0:
-                continue
-            try:
-                # 检查当前位置是否在附件范围内
-                span = _find_marked_span(doc, pos, self.ATTACHMENT_TAG_PROP, tag_value)
-                if span:
-                    start, end_exclusive = span
-                    # 更新边界
-                    if min_start is None or start < min_start:
-                        min_start = start
-                    if max_end is None or end_exclusive > max_end:
-                        max_end = end_exclusive
-            except Exception:
-                pass
-        
-        if min_start is not None and max_end is not None:
-            return (min_start, max_end)
-        return None
+        # 按块/片段遍历选择范围：附件字符的片段本身就带有标记，不需要逐字符检查
+        block = doc.findBlock(sel_start)
+        while block.isValid() and block.position() < sel_end:
+            it = block.begin()
+            while not it.atEnd():
+                frag = it.fragment()
+                if frag.isValid():
+                    f_start = frag.position()
+                    f_end = f_start + frag.length()
+                    if f_start >= sel_end:
+                        break
+                    if f_end > sel_start and _format_has_tag(frag.charFormat(), self.ATTACHMENT_TAG_PROP, tag_value):
+                        if min_start is None or f_start < min_start:
+                            min_start = f_start
+                        if max_end is None or f_end > max_end:
+                            max_end = f_end
+                it += 1
+            block = block.next()
+        
+        if min_start is None or max_end is None:
+            return None
+        
+        # 同一附件可能被拆成多个相邻片段，两端再合并到完整的标记范围
+        try:
+            run = _find_fragment_with_property(doc, min_start, self.ATTACHMENT_TAG_PROP, tag_value)
+            if run is not None:
+                min_start = min(min_start, run[0])
+            run = _find_fragment_with_property(doc, max_end - 1, self.ATTACHMENT_TAG_PROP, tag_value)
+            if run is not None:
+                max_end = max(max_end, run[1])
+        except Exception:
+            pass
+        return (min_start, max_end)
     
     def _apply_expanded_selection(self, doc: QTextDocument, start: int, end: int):
         """应用扩展后的选择范围
@@ -1322,33 +1910,63 @@ class PasteImageTextEdit(QTextEdit):
         doc = self.document()
         sel_start = cursor.selectionStart()
         sel_end = cursor.selectionEnd()
-        tag_value = getattr(self, "_attachment_tag_name", "")
+        tag_value = self._attachment_tag_id
         
-        if not tag_value:
+        if not tag_value or not self._has_attachments():
             return
 
-        # 获取需要检查的位置列表
-        check_positions = self._get_check_positions(sel_start, sel_end)
-        logger.debug(
-            "[expend-selection] selected_pos: start=%s end=%s cursor_pos=%s",
-            sel_start,
-            sel_end,
-            cursor.position()
-        )
+        # 拖动选择时连续的移动事件大多选区不变，或只在一端延伸：不变时直接返回，延伸时只扫描新增部分
+        revision = doc.revision()
+        key = (sel_start, sel_end, revision)
+        last_start, last_end, last_revision = self._last_expand_key
+        if key == self._last_expand_key:
+            return
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "[expend-selection] selected_pos: start=%s end=%s cursor_pos=%s",
+                sel_start,
+                sel_end,
+                cursor.position()
+            )
         # 查找所有附件的边界
-        bounds = self._find_attachment_bounds(doc, check_positions, tag_value)
+        if last_revision == revision and sel_start == last_start and sel_end > last_end:
+            delta = self._find_attachment_bounds(doc, last_end, sel_end, tag_value)
+            bounds = self._merge_bounds(self._last_expand_bounds, delta)
+        elif last_revision == revision and sel_end == last_end and sel_start < last_start:
+            delta = self._find_attachment_bounds(doc, sel_start, last_start, tag_value)
+            bounds = self._merge_bounds(self._last_expand_bounds, delta)
+        else:
+            bounds = self._find_attachment_bounds(doc, sel_start, sel_end, tag_value)
+        self._last_expand_key = key
+        self._last_expand_bounds = bounds
         # 如果找到附件且范围有扩展，更新选择
         if bounds:
             expanded_start, expanded_end = bounds
-            logger.debug(
-                "[expend-selection] find_bounds: expanded_start=%s expanded_end=%s cursor_pos=%s",
-                expanded_start,
-                expanded_end,
-                cursor.position()
-            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "[expend-selection] find_bounds: expanded_start=%s expanded_end=%s cursor_pos=%s",
+                    expanded_start,
+                    expanded_end,
+                    cursor.position()
+                )
             if expanded_start < sel_start or expanded_end > sel_end:
-                self._apply_expanded_selection(doc, min(expanded_start, sel_start), max(expanded_end, sel_end))
+                new_start = min(expanded_start, sel_start)
+                new_end = max(expanded_end, sel_end)
+                self._apply_expanded_selection(doc, new_start, new_end)
+                # 扩展后的选区包含的附件与本次相同，下次移动时可直接复用
+                self._last_expand_key = (new_start, new_end, revision)
+    
+    @staticmethod
+    def _merge_bounds(a, b):
+        """合并两个 (start, end) 范围，任一为 None 时返回另一个"""
+        if a is None:
+            return b
+        if b is None:
+            return a
+        return (min(a[0], b[0]), max(a[1], b[1]))
     
+    @_batch_viewport_updates
     def mouseReleaseEvent(self, event):
         """鼠标释放事件"""
         
@@ -1357,6 +1975,10 @@ class PasteImageTextEdit(QTextEdit):
             self.mouse_pressed = False
         
         if self.resizing:
+            pending_size = self._pending_resize_size
+            self._pending_resize_size = None
+            if pending_size:
+                self.update_image_size(*pending_size)
             self.resizing = False
             self.resize_handle = None
             self.resize_start_pos = None
@@ -1380,12 +2002,13 @@ class PasteImageTextEdit(QTextEdit):
             self.drag_start_pos = None
             self.drag_start_cursor_pos = None
             self.drag_preview_cursor = None  # 清除预览光标
+            self._last_drag_pos = None
             
             # 拖动结束后取消选中状态，允许用户重新点击选择
             self.selected_image = None
             self.selected_image_rect = None
             self.selected_image_cursor = None
-            self.viewport().update()
+            self._mark_viewport_dirty()
             
             event.accept()
             return
@@ -1401,27 +2024,27 @@ class PasteImageTextEdit(QTextEdit):
         Returns:
             tuple: (formula_type, code) 或 (None, None)
         """
+        if image_name.startswith(_FORMULA_URL_PREFIX):
+            meta = self.parent_editor.get_formula_meta(image_name) if self.parent_editor else None
+            return meta if meta else (None, None)
+        
         if '|||MATH:' not in image_name:
             return None, None
         
-        parts = image_name.split('|||', 1)
-        if len(parts) != 2:
+        _, sep, metadata = image_name.partition('|||')  # metadata: MATH:type:code
+        if not sep:
             return None, None
         
-        metadata = parts[1]  # MATH:type:code
-        
         # 解析元数据
         if not metadata.startswith('MATH:'):
             return None, None
         
-        metadata_parts = metadata[5:].split(':', 1)  # 去掉 'MATH:' 前缀
-        if len(metadata_parts) != 2:
+        formula_type, sep, escaped_code = metadata[5:].partition(':')  # 去掉 'MATH:' 前缀
+        if not sep:
             return None, None
         
-        formula_type = metadata_parts[0]
-        escaped_code = metadata_parts[1]
         # 反转义HTML实体
-        code = html.unescape(escaped_code)
+        code = _HTML_UNESCAPE(escaped_code)
         
         return formula_type, code
     
@@ -1439,8 +2062,13 @@ class PasteImageTextEdit(QTextEdit):
         formula_type, code = self._parse_math_formula_metadata(image_name)
         
         if formula_type and code and self.parent_editor:
+            # 用选中图片字符的光标跟踪公式位置：编辑对话框打开期间文档若有变化，
+            # Qt 会自动调整光标，更新时无需再探测图片字符的位置
+            anchored_cursor = QTextCursor(image_cursor)
+            anchored_cursor.setPosition(image_cursor.position())
+            anchored_cursor.setPosition(image_cursor.position() + 1, QTextCursor.MoveMode.KeepAnchor)
             self.parent_editor.edit_math_formula(
-                code, formula_type, image_cursor, image_format
+                code, formula_type, anchored_cursor, image_format
             )
             return True
         
@@ -1455,7 +2083,20 @@ class PasteImageTextEdit(QTextEdit):
         Returns:
             bool: 是否处理了图片双击
         """
-        image_format, image_cursor, image_rect = self.find_image_at_position(event.pos())
+        # 双击的第一下通常已经选中了图片：点在已选中图片的矩形内时直接复用，不再做命中测试
+        pos = event.pos()
+        selected_rect = self.selected_image_rect
+        if (
+            self.selected_image
+            and self.selected_image_cursor
+            and selected_rect
+            and selected_rect.contains(pos)
+        ):
+            image_format = self.selected_image
+            image_cursor = self.selected_image_cursor
+            image_rect = selected_rect
+        else:
+            image_format, image_cursor, image_rect = self.find_image_at_position(pos)
         
         if not (image_format and image_cursor):
             return False
@@ -1469,7 +2110,7 @@ class PasteImageTextEdit(QTextEdit):
         self.selected_image = image_format
         self.selected_image_cursor = image_cursor
         self.selected_image_rect = image_rect
-        self.viewport().update()
+        self._mark_viewport_dirty()
         # 阻止默认的双击行为（选中文字等）
         event.accept()
         return True
@@ -1497,6 +2138,7 @@ class PasteImageTextEdit(QTextEdit):
         
         return False
     
+    @_batch_viewport_updates
     def mouseDoubleClickEvent(self, event):
         """鼠标双击事件 - 防止双击图片时被删除"""
         if event.button() != Qt.MouseButton.LeftButton:
@@ -1675,10 +2317,13 @@ class PasteImageTextEdit(QTextEdit):
                 self.selected_table_cursor = None
                 self.viewport().update()
     
-    def _log_attachment_delete_before(self, doc, del_key, current_cursor, attachment_sel, marked_span):
+    def _log_attachment_delete_before(self, doc, del_key, current_cursor, attachment_sel):
         """记录附件删除前的调试信息"""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        # 调试日志失败不能影响删除操作本身
         try:
-            _doc_len = doc.characterCount() if doc is not None else -1
+            _doc_len = doc.characterCount()
             _cur_pos = current_cursor.position()
             _sel_s = attachment_sel.selectionStart()
             _sel_e = attachment_sel.selectionEnd()
@@ -1694,6 +2339,13 @@ class PasteImageTextEdit(QTextEdit):
                 _sel_e,
             )
             
+            # 标记范围只用于日志，仅在 DEBUG 下计算
+            marked_span = _find_marked_span(
+                doc,
+                _sel_s,
+                self.ATTACHMENT_TAG_PROP,
+                self._attachment_tag_id,
+            )
             if marked_span is not None:
                 _ms, _me = marked_span
                 logger.debug(
@@ -1709,7 +2361,7 @@ class PasteImageTextEdit(QTextEdit):
             logger.debug(
                 "[attachment-delete][before] window=(%s,%s) chars=%s",
                 max(0, _win_s),
-                min(max(0, doc.characterCount() - 1), _win_e),
+                min(max(0, _doc_len - 1), _win_e),
                 _dump_doc_chars(doc, _win_s, _win_e)
             )
             logger.debug(
@@ -1721,54 +2373,47 @@ class PasteImageTextEdit(QTextEdit):
     
     def _extract_and_defer_delete_attachments(self, attachment_sel):
         """提取附件ID并延迟删除"""
+        am = self._attachment_manager
+        note_id = self.parent_editor.current_note_id if am else None
+        if not note_id:
+            return
         try:
-            selected_html = attachment_sel.selection().toHtml()
-            attachment_ids = []
-            
-            # 从 attachment://xxx 提取附件ID
-            try:
-                import re
-                attachment_ids.extend(re.findall(r"attachment://([a-fA-F0-9\-]{16,})", selected_html))
-            except Exception:
-                pass
-            
-            # 去重
-            attachment_ids = list(dict.fromkeys([x for x in attachment_ids if x]))
+            # 直接读取选区内片段的链接地址，从 attachment://xxx 提取附件ID并去重
+            hrefs = _collect_anchor_hrefs(
+                self.document(), attachment_sel.selectionStart(), attachment_sel.selectionEnd()
+            )
+            attachment_ids = list({
+                m.group(1) for m in map(_ATTACHMENT_ID_RE.match, hrefs) if m
+            })
             
             logger.debug("[attachment-delete] extracted_attachment_ids=%s", attachment_ids)
             
-            if attachment_ids and self.parent_editor and getattr(self.parent_editor, "note_manager", None):
-                note_id = getattr(self.parent_editor, "current_note_id", None)
-                am = getattr(self.parent_editor.note_manager, "attachment_manager", None)
-                if note_id and am:
-                    for aid in attachment_ids:
-                        ok, msg = am.defer_delete_attachment(aid, note_id)
-                        logger.debug("[attachment-delete] defer_delete_attachment id=%s ok=%s msg=%s", aid, ok, msg)
+            for aid in attachment_ids:
+                ok, msg = am.defer_delete_attachment(aid, note_id)
+                logger.debug("[attachment-delete] defer_delete_attachment id=%s ok=%s msg=%s", aid, ok, msg)
         except Exception as e:
             logger.exception("[attachment-delete] delete_attachment pre-clean failed: %s", e)
     
     def _log_attachment_delete_after(self, doc, safe_pos):
         """记录附件删除后的调试信息"""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        # 调试日志失败不能影响删除操作本身
         try:
             _after_len = doc.characterCount()
-        except Exception:
-            _after_len = -1
-        
-        logger.debug(
-            "[attachment-delete] after_delete safe_pos=%s doc_len=%s",
-            safe_pos,
-            _after_len,
-        )
-        
-        # 检查是否仍残留被标记范围
-        try:
+            logger.debug(
+                "[attachment-delete] after_delete safe_pos=%s doc_len=%s",
+                safe_pos,
+                _after_len,
+            )
+            
+            # 检查是否仍残留被标记范围
             _marked_span_after = _find_marked_span(
                 doc,
                 safe_pos,
                 self.ATTACHMENT_TAG_PROP,
-                getattr(self, "_attachment_tag_name", ""),
+                self._attachment_tag_id,
             )
-            
             if _marked_span_after is not None:
                 _ms2, _me2 = _marked_span_after
                 logger.debug(
@@ -1780,16 +2425,13 @@ class PasteImageTextEdit(QTextEdit):
                 )
             else:
                 logger.debug("[attachment-delete][after] marked_span=<none>")
-        except Exception:
-            pass
-        
-        try:
+            
             _after_win_s = safe_pos - 40
             _after_win_e = safe_pos + 80
             logger.debug(
                 "[attachment-delete][after] window=(%s,%s) chars=%s",
                 max(0, _after_win_s),
-                min(max(0, doc.characterCount() - 1), _after_win_e),
+                min(max(0, _after_len - 1), _after_win_e),
                 _dump_doc_chars(doc, _after_win_s, _after_win_e)
             )
         except Exception:
@@ -1807,39 +2449,25 @@ class PasteImageTextEdit(QTextEdit):
         doc = self.document()
         del_key = "Delete" if event.key() == Qt.Key.Key_Delete else "Backspace"
         
-        # 获取标记范围
-        _sel_s = attachment_sel.selectionStart()
-        _marked_span = _find_marked_span(
-            doc,
-            _sel_s,
-            self.ATTACHMENT_TAG_PROP,
-            getattr(self, "_attachment_tag_name", ""),
-        )
-        
         # 记录删除前信息
-        self._log_attachment_delete_before(doc, del_key, current_cursor, attachment_sel, _marked_span)
+        self._log_attachment_delete_before(doc, del_key, current_cursor, attachment_sel)
         
         # 延迟删除附件文件
         self._extract_and_defer_delete_attachments(attachment_sel)
         
-        # 删除文本块
-        pre_start = attachment_sel.selectionStart()
+        # 删除文本块并恢复光标位置：放在同一个编辑块里，文档变化信号和重绘在块结束时只触发一次
+        safe_pos = attachment_sel.selectionStart()
         attachment_sel.beginEditBlock()
-        attachment_sel.removeSelectedText()
-        attachment_sel.endEditBlock()
-        
-        safe_pos = pre_start
-        
-        # 记录删除后信息
-        self._log_attachment_delete_after(doc, safe_pos)
-        
-        # 恢复光标位置
         try:
+            attachment_sel.removeSelectedText()
             attachment_sel.clearSelection()
             _safe_set_cursor_position(doc, attachment_sel, safe_pos, "attachment-delete:restore-cursor")
             self.setTextCursor(attachment_sel)
-        except Exception:
-            self.setTextCursor(attachment_sel)
+        finally:
+            attachment_sel.endEditBlock()
+        
+        # 记录删除后信息（编辑块结束后再读取文档）
+        self._log_attachment_delete_after(doc, safe_pos)
         
         event.accept()
         return True
@@ -1879,20 +2507,28 @@ class PasteImageTextEdit(QTextEdit):
         
         返回：True 表示已处理，False 表示未处理
         """
+        key = event.key()
+        is_delete = key == Qt.Key.Key_Delete
+        if not is_delete and key != Qt.Key.Key_Backspace:
+            return False
+        
         frame = self.document().rootFrame()
         for child_frame in frame.childFrames():
             table = child_frame
             if not hasattr(table, 'firstPosition'):
                 continue
             
-            table_start = table.firstPosition()
-            table_end = table.lastPosition()
-            
-            # 检查光标是否紧邻表格
-            is_before_table = (event.key() == Qt.Key.Key_Delete and 
-                              cursor_pos <= table_start and cursor_pos >= table_start - 2)
-            is_after_table = (event.key() == Qt.Key.Key_Backspace and 
-                             cursor_pos >= table_end + 1 and cursor_pos <= table_end + 3)
+            # 检查光标是否紧邻表格（Delete 只看表格开头，Backspace 只看表格结尾）
+            if is_delete:
+                table_start = table.firstPosition()
+                is_before_table = table_start - 2 <= cursor_pos <= table_start
+                is_after_table = False
+            else:
+                table_end = table.lastPosition()
+                is_after_table = table_end + 1 <= cursor_pos <= table_end + 3
+                is_before_table = False
+                if is_after_table:
+                    table_start = table.firstPosition()
             
             if is_before_table or is_after_table:
                 # 选中表格
@@ -1923,9 +2559,13 @@ class PasteImageTextEdit(QTextEdit):
     def keyPressEvent(self, event):
         """键盘事件 - 使用默认行为，允许删除选区中的所有内容（包括图片）"""
         key = event.key()
-        key_text = event.text()
-        modifiers = event.modifiers()
-        logger.debug(f"[keyPressEvent] 按键事件触发 - key: {key}, text: '{key_text}', modifiers: {modifiers}")
+        # 每次按键都会经过这里：调试日志的参数只在 DEBUG 开启时才计算
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+        if debug_enabled:
+            logger.debug(f"[keyPressEvent] 按键事件触发 - key: {key}, text: '{event.text()}', modifiers: {event.modifiers()}")
+        
+        # 先完成排队中的格式检查，按键输入的字符才能使用正确的标题/正文格式
+        self._flush_format_update()
         
         # 处理第一行标题格式
         # need_restore_format, saved_format = self._handle_first_line_title_format(event)
@@ -1935,8 +2575,9 @@ class PasteImageTextEdit(QTextEdit):
         self._restore_cursor_and_clear_table_selection(event)
         
         # 处理删除键
-        if event.key() in (Qt.Key.Key_Delete, Qt.Key.Key_Backspace):
-            logger.debug(f"[keyPressEvent] 检测到删除键: {'Delete' if key == Qt.Key.Key_Delete else 'Backspace'}")
+        if key in (Qt.Key.Key_Delete, Qt.Key.Key_Backspace):
+            if debug_enabled:
+                logger.debug(f"[keyPressEvent] 检测到删除键: {'Delete' if key == Qt.Key.Key_Delete else 'Backspace'}")
             current_cursor = self.textCursor()
             
             # 先处理附件删除
@@ -1955,7 +2596,8 @@ class PasteImageTextEdit(QTextEdit):
             
             # 处理表格选中（第一次按删除键）
             cursor_pos = current_cursor.position()
-            logger.debug(f"[keyPressEvent] 检查是否需要选中表格 - cursor_pos: {cursor_pos}")
+            if debug_enabled:
+                logger.debug(f"[keyPressEvent] 检查是否需要选中表格 - cursor_pos: {cursor_pos}")
             if self._handle_table_selection(event, cursor_pos):
                 logger.debug("[keyPressEvent] 表格已选中，返回")
                 return
@@ -1976,25 +2618,27 @@ class PasteImageTextEdit(QTextEdit):
         输入法输入完成后，会自动触发格式更新，确保标题格式正确。
         """
         commit_string = event.commitString()
-        preedit_string = event.preeditString()
-        logger.debug(f"[inputMethodEvent] 输入法事件触发 - commitString: '{commit_string}', preeditString: '{preedit_string}'")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[inputMethodEvent] 输入法事件触发 - commitString: '{commit_string}', preeditString: '{event.preeditString()}'")
+        
+        # 预编辑阶段（组字中）每个按键都会触发，直接交给父类处理
+        if not commit_string:
+            super().inputMethodEvent(event)
+            return
+        
+        # 先完成排队中的格式检查，再判断是否需要预设置标题格式
+        self._flush_format_update()
         
         # 在输入前预设置标题格式（如果需要）
-        if commit_string and self._should_apply_title_format_before_input():
+        if self._should_apply_title_format_before_input():
             logger.debug("[inputMethodEvent] 需要在输入前预设置标题格式")
             self._apply_title_format_to_cursor()
-        elif commit_string:
-            logger.debug("[inputMethodEvent] 有提交文本但不需要预设置格式")
         
         # 调用父类方法处理输入法事件
         super().inputMethodEvent(event)
         
         # 输入完成后，触发格式检查和更新
-        if commit_string:
-            logger.debug("[inputMethodEvent] 输入完成，触发格式更新")
-            self._trigger_format_update()
-        else:
-            logger.debug("[inputMethodEvent] 无提交文本（预编辑阶段），跳过格式更新")
+        self._trigger_format_update()
     
     def _should_apply_title_format_before_input(self) -> bool:
         """判断是否需要在输入前应用标题格式
@@ -2002,15 +2646,14 @@ class PasteImageTextEdit(QTextEdit):
         Returns:
             bool: 如果光标在第一行且该行为空，返回 True
         """
-        cursor = self.textCursor()
-        block = cursor.block()
+        block = self.textCursor().block()
         
         # 只在第一行且为空时才需要预设置格式
         if block.blockNumber() != 0:
             return False
         
         block_text = block.text()
-        return block_text == "" or block_text == "\u200B"
+        return not block_text or block_text == "\u200B"
     
     def _apply_title_format_to_cursor(self):
         """为当前光标应用标题格式"""
@@ -2029,6 +2672,43 @@ class PasteImageTextEdit(QTextEdit):
         if parent and hasattr(parent, 'update_title_and_input_format'):
             parent.update_title_and_input_format()
     
+    def _flush_format_update(self):
+        """执行父对象中尚未执行的格式检查（光标变化触发的检查会合并到事件循环空闲时）"""
+        parent = self.parent()
+        if parent and hasattr(parent, 'flush_title_format_update'):
+            parent.flush_title_format_update()
+    
+    def _find_image_char_near(self, pos: int, doc: QTextDocument | None = None) -> tuple[int, bool] | None:
+        """查找 pos 处或其后一个位置的真正图片字符（U+FFFC），不移动任何光标
+        
+        Returns:
+            (图片字符位置, 图片前是否为带图片格式的段落分隔符)；找不到返回 None
+        """
+        if self._image_index is None:
+            self._build_image_index()
+        image_index = self._image_index
+        for real_image_pos in (pos, pos + 1):
+            if real_image_pos in image_index:
+                break
+        else:
+            return None
+        
+        # 检查图片字符前面是否有段落分隔符（在空行行首插入图片时 Qt 会先插入一个）
+        has_paragraph_separator = False
+        if doc is None:
+            doc = self.document()
+        if real_image_pos > 0 and doc.characterAt(real_image_pos - 1) == '\u2029':
+            prev_format = self._char_format_at(real_image_pos - 1)
+            has_paragraph_separator = prev_format is not None and prev_format.isImageFormat()
+        return real_image_pos, has_paragraph_separator
+
+    def _preview_image_size(self, new_width, new_height):
+        """缩放拖动中记录待应用的图片尺寸，只重绘预览框，不修改文档"""
+        if self._pending_resize_size == (new_width, new_height):
+            return
+        self._pending_resize_size = (new_width, new_height)
+        self._mark_viewport_dirty()
+
     def update_image_size(self, new_width, new_height):
         """更新图片尺寸"""
         if not self.selected_image or not self.selected_image_cursor:
@@ -2037,108 +2717,39 @@ class PasteImageTextEdit(QTextEdit):
         # 保存原位置
         old_pos = self.selected_image_cursor.position()
         
-        # 创建光标对象
-        cursor = QTextCursor(self.document())
-        
-        # 使用编辑块确保删除和插入是原子操作
-        cursor.beginEditBlock()
+        doc = self.document()
         
         # **关键修复**：查找真正的图片字符位置（U+FFFC）
         # 从 old_pos 开始，向右查找最多2个字符，找到真正的图片字符
-        real_image_pos = None
-        has_paragraph_separator = False
-        
-        for offset in range(2):  # 检查当前位置和下一个位置
-            check_pos = old_pos + offset
-            cursor.setPosition(check_pos)
-            
-            # 向右移动一个字符并选中
-            if _select_char_at(cursor, check_pos):
-                selected_text = cursor.selectedText()
-                char_format = cursor.charFormat()
-                
-                # 检查是否是真正的图片字符
-                if char_format.isImageFormat() and selected_text == '\ufffc':
-                    real_image_pos = check_pos
-                    
-                    # 检查图片字符前面是否有段落分隔符
-                    if real_image_pos > 0:
-                        _select_char_at(cursor, real_image_pos - 1)
-                        prev_text = cursor.selectedText()
-                        prev_format = cursor.charFormat()
-                        
-                        if prev_format.isImageFormat() and prev_text == '\u2029':
-                            has_paragraph_separator = True
-                    
-                    break
-            
-            # 清除选区，继续查找
-            cursor.clearSelection()
-        
-        if real_image_pos is None:
-            cursor.endEditBlock()
+        found = self._find_image_char_near(old_pos, doc)
+        if found is None:
             return
+        real_image_pos = found[0]
         
-        # **关键修复**：检查图片是否是公式（通过检查图片名称中的元数据）
-        # 新格式：data:image/png;base64,...|||MATH:type:code
-        image_name = self.selected_image.name()
-        
-        is_formula = False
-        formula_metadata = None
-        image_base_name = image_name
-        
-        # 检查是否包含公式元数据（使用 ||| 分隔符）
-        if '|||MATH:' in image_name:
-            parts = image_name.split('|||', 1)
-            if len(parts) == 2:
-                is_formula = True
-                image_base_name = parts[0]  # data:image/png;base64,...
-                formula_metadata = parts[1]  # MATH:type:code
-        
-        # **优化**：只删除图片字符本身，保留段落分隔符（如果有）
-        # 移动到图片字符位置
-        cursor.setPosition(real_image_pos)
-        
-        # 向右选中图片字符（只删除1个字符）
-        _select_char_at(cursor, cursor.position())
-        
-        # 删除选中的图片字符
-        cursor.removeSelectedText()
-        
-        # 在删除位置插入新图片
+        # 原地合并新尺寸到图片字符的格式，不再删除后重新插入：
+        # 文档只改一次格式、撤销栈只记一步，图片的其他字符属性也得以保留。
+        # 名称原样写回：公式图片的元数据（data:...|||MATH:type:code）随名称一起保留
         new_format = QTextImageFormat()
-        if is_formula and formula_metadata:
-            # 如果是公式，重新组合图片名称（保留元数据）
-            new_format.setName(f"{image_base_name}|||{formula_metadata}")
-        else:
-            # 普通图片
-            new_format.setName(image_name)
-        
+        new_format.setName(self.selected_image.name())
         new_format.setWidth(new_width)
         new_format.setHeight(new_height)
         # 设置垂直对齐方式为AlignBaseline，使图片底部与文本基线对齐
         new_format.setVerticalAlignment(QTextCharFormat.VerticalAlignment.AlignBaseline)
-        cursor.insertImage(new_format)
-        
-        # 结束编辑块
-        cursor.endEditBlock()
+        cursor = QTextCursor(doc)
+        _select_char_at(cursor, real_image_pos)
+        cursor.mergeCharFormat(new_format)
         
-        # 更新选中状态（光标现在在图片之后，需要向左移动一个位置）
-        cursor.movePosition(QTextCursor.MoveOperation.Left, QTextCursor.MoveMode.MoveAnchor, 1)
-        
-        # 重新获取图片格式（因为可能已经改变）
-        _select_char_at(cursor, cursor.position())
+        # 更新选中状态（重新获取合并后的图片格式）
         new_char_format = cursor.charFormat()
         if new_char_format.isImageFormat():
             self.selected_image = new_char_format.toImageFormat()
-        cursor.clearSelection()
-        cursor.movePosition(QTextCursor.MoveOperation.Left, QTextCursor.MoveMode.MoveAnchor, 1)
+        cursor.setPosition(real_image_pos)
         
         self.selected_image_cursor = cursor
         self.selected_image_rect = self.get_image_rect_at_cursor(cursor)
         
-        # 刷新显示
-        self.viewport().update()
+        # 刷新显示（鼠标事件内合并为一次重绘）
+        self._mark_viewport_dirty()
     
     def move_image_to_cursor(self, target_cursor):
         """移动图片到新的光标位置"""
@@ -2158,7 +2769,8 @@ class PasteImageTextEdit(QTextEdit):
         old_pos = self.selected_image_cursor.position()
         
         # **关键修复**：使用同一个光标对象执行所有操作，确保在编辑块中
-        cursor = QTextCursor(self.document())
+        doc = self.document()
+        cursor = QTextCursor(doc)
         
         # 开始编辑块
         cursor.beginEditBlock()
@@ -2166,39 +2778,11 @@ class PasteImageTextEdit(QTextEdit):
         # 1. 删除原位置的图片
         # **关键修复**：查找真正的图片字符位置（U+FFFC）
         # 从 old_pos 开始，向右查找最多2个字符，找到真正的图片字符
-        real_image_pos = None
-        has_paragraph_separator = False
-        
-        for offset in range(2):  # 检查当前位置和下一个位置
-            check_pos = old_pos + offset
-            cursor.setPosition(check_pos)
-            
-            # 向右移动一个字符并选中
-            if _select_char_at(cursor, check_pos):
-                selected_text = cursor.selectedText()
-                char_format = cursor.charFormat()
-                
-                # 检查是否是真正的图片字符
-                if char_format.isImageFormat() and selected_text == '\ufffc':
-                    real_image_pos = check_pos
-                    
-                    # 检查图片字符前面是否有段落分隔符
-                    if real_image_pos > 0:
-                        _select_char_at(cursor, real_image_pos - 1)
-                        prev_text = cursor.selectedText()
-                        prev_format = cursor.charFormat()
-                        
-                        if prev_format.isImageFormat() and prev_text == '\u2029':
-                            has_paragraph_separator = True
-                    
-                    break
-            
-            # 清除选区，继续查找
-            cursor.clearSelection()
-        
-        if real_image_pos is None:
+        found = self._find_image_char_near(old_pos, doc)
+        if found is None:
             cursor.endEditBlock()
             return
+        real_image_pos, has_paragraph_separator = found
         
         # **关键修复**：如果有段落分隔符，从段落分隔符位置开始删除
         delete_start_pos = real_image_pos - 1 if has_paragraph_separator else real_image_pos
@@ -2222,14 +2806,14 @@ class PasteImageTextEdit(QTextEdit):
         # 结束编辑块
         cursor.endEditBlock()
         
-        # 更新选中状态
-        cursor.movePosition(QTextCursor.MoveOperation.Left, QTextCursor.MoveMode.MoveAnchor, 1)
+        # 更新选中状态（光标定位到新插入的图片字符之前）
+        cursor.setPosition(adjusted_target_pos)
         self.selected_image = image_format
         self.selected_image_cursor = cursor
         self.selected_image_rect = self.get_image_rect_at_cursor(cursor)
         
-        # 刷新显示
-        self.viewport().update()
+        # 刷新显示（鼠标事件内合并为一次重绘）
+        self._mark_viewport_dirty()
     
     # 注释掉此函数以提升性能，需要调试时可以重新启用
     # def count_all_images(self):
@@ -2284,6 +2868,28 @@ class PasteImageTextEdit(QTextEdit):
     #     return count, positions
     
 
+    def loadResource(self, type, name):
+        """加载文档资源：formula:// 图片不在当前文档的资源缓存中时（如跨笔记粘贴），从公式数据恢复；
+        旧格式公式图片按需渲染（Qt 只在需要绘制图片时才加载资源，屏幕外的公式不会渲染）"""
+        if type == QTextDocument.ResourceType.ImageResource.value and self.parent_editor:
+            if name.scheme() == "formula":
+                image = self.parent_editor.load_formula_resource(name.toString())
+            else:
+                # 旧格式公式图片（data:...|||MATH:type:code）在首次绘制时才渲染
+                image = self.parent_editor.load_legacy_formula_resource(name.toString())
+            if image is not None:
+                return image
+        return super().loadResource(type, name)
+
+    def createMimeDataFromSelection(self):
+        """复制时把 formula:// 图片还原为内嵌数据，保证粘贴到其他地方仍可显示"""
+        mime = super().createMimeDataFromSelection()
+        if self.parent_editor and mime.hasHtml():
+            selected_html = mime.html()
+            if _FORMULA_URL_PREFIX in selected_html:
+                mime.setHtml(self.parent_editor._expand_formula_resources(selected_html))
+        return mime
+
     def canInsertFromMimeData(self, source):
         """检查是否可以从MIME数据插入"""
         if source.hasImage() or source.hasUrls():
@@ -2293,7 +2899,12 @@ class PasteImageTextEdit(QTextEdit):
     def insertFromMimeData(self, source):
         """从MIME数据插入（支持截图粘贴）"""
         
-        # 处理图片
+        # 处理图片：剪贴板里已有PNG字节时直接嵌入，省去解码再编码
+        if source.hasFormat("image/png") and self.parent_editor:
+            data = source.data("image/png").data()
+            if self.parent_editor.insert_image_from_bytes(data, "image/png"):
+                return
+
         if source.hasImage():
             image = QImage(source.imageData())
             if not image.isNull():
@@ -2307,6 +2918,14 @@ class PasteImageTextEdit(QTextEdit):
                 if url.isLocalFile():
                     file_path = url.toLocalFile()
                     if self.is_image_file(file_path):
+                        if file_path.lower().endswith('.png') and self.parent_editor:
+                            try:
+                                with open(file_path, 'rb') as f:
+                                    data = f.read()
+                            except OSError:
+                                data = b''
+                            if data and self.parent_editor.insert_image_from_bytes(data, "image/png"):
+                                return
                         image = QImage(file_path)
                         if not image.isNull():
                             if self.parent_editor:
@@ -2318,9 +2937,8 @@ class PasteImageTextEdit(QTextEdit):
     
     def is_image_file(self, file_path):
         """检查是否是图片文件"""
-        image_extensions = ['.png', '.jpg', '.jpeg', '.gif', '.bmp', '.svg']
         ext = os.path.splitext(file_path)[1].lower()
-        return ext in image_extensions
+        return ext in _IMAGE_EXTENSIONS
 
 
 class NoteEditor(QWidget):
@@ -2331,6 +2949,31 @@ class NoteEditor(QWidget):
         self.note_manager = note_manager
         self.current_note_id = None  # 当前编辑的笔记ID
         self.attachments = {}  # 存储附件 {filename: filepath}
+        # 公式渲染结果缓存 {(formula_type, code): (width, height, image)}
+        self._formula_cache = collections.OrderedDict()
+        self._formula_cache_maxsize = 128
+        # 公式图片资源的元数据 {formula://id: (formula_type, code, image)}
+        self._formula_meta = {}
+        # 旧格式公式图片 {QUrl 字符串: (formula_type, code)}，首次绘制时渲染
+        self._legacy_formulas = {}
+        # 第一行已是标题格式的缓存；第一行内容/格式变化时置为 None 重新检查
+        self._first_line_title_ok = None
+        # 上次写入格式菜单勾选状态时的格式摘要，相同时跳过 setChecked
+        self._last_menu_state = None
+        # 切换粗体/斜体/下划线/删除线时合并的格式增量 {目标状态: 格式}，只改动对应的一个属性
+        self._fmt_bold = {
+            True: _single_property_format(QTextCharFormat.setFontWeight, QFont.Weight.Bold),
+            False: _single_property_format(QTextCharFormat.setFontWeight, QFont.Weight.Normal),
+        }
+        self._fmt_italic = {v: _single_property_format(QTextCharFormat.setFontItalic, v) for v in (True, False)}
+        self._fmt_underline = {v: _single_property_format(QTextCharFormat.setFontUnderline, v) for v in (True, False)}
+        self._fmt_strikeout = {v: _single_property_format(QTextCharFormat.setFontStrikeOut, v) for v in (True, False)}
+        # 公式图片的PNG数据（保存时使用，后台线程编码） {(formula_type, code): image_base64}
+        self._formula_png_base64 = {}
+        # 图片格式模板：预设垂直对齐方式为AlignBaseline（图片底部与文本基线对齐），
+        # 插入时复制后只需设置名称和尺寸
+        self._img_fmt_proto = QTextImageFormat()
+        self._img_fmt_proto.setVerticalAlignment(QTextCharFormat.VerticalAlignment.AlignBaseline)
         self.init_ui()
         
     def init_ui(self):
@@ -2366,8 +3009,14 @@ class NoteEditor(QWidget):
         # 启用富文本
         self.text_edit.setAcceptRichText(True)
         
-        # 监听光标位置变化，自动格式化第一行
-        self.text_edit.cursorPositionChanged.connect(self.update_title_and_input_format)
+        # 监听光标位置变化，自动格式化第一行；
+        # 连续的光标变化（输入、拖选、粘贴、撤销）合并为事件循环空闲时的一次检查
+        self._title_format_timer = QTimer(self)
+        self._title_format_timer.setSingleShot(True)
+        self._title_format_timer.setInterval(0)
+        self._title_format_timer.timeout.connect(self.update_title_and_input_format)
+        self.text_edit.cursorPositionChanged.connect(self._title_format_timer.start)
+        self.text_edit.document().contentsChange.connect(self._invalidate_first_line_state)
         
         layout.addWidget(self.text_edit)
         
@@ -2509,6 +3158,9 @@ class NoteEditor(QWidget):
         
         # 连接格式菜单的aboutToShow信号，在显示前更新状态
         format_menu.aboutToShow.connect(self.update_format_menu_state)
+        # 触发可勾选动作（点击或快捷键）会自行切换勾选状态，此时缓存的摘要不再可信
+        format_menu.triggered.connect(self._invalidate_menu_state)
+        list_menu.triggered.connect(self._invalidate_menu_state)
         
         # 格式按钮
         format_button = QPushButton("格式")
@@ -2563,38 +3215,44 @@ class NoteEditor(QWidget):
         return self.text_edit.textChanged
     
     def toHtml(self):
-        return self.text_edit.toHtml()
+        return self._expand_formula_resources(self.text_edit.toHtml())
     
     def toPlainText(self):
         return self.text_edit.toPlainText()
     
     def setHtml(self, html_content):
         """设置HTML内容，并重新渲染数学公式"""
+        # setHtml 会替换文档及其资源，上一篇笔记登记的公式图片和PNG数据随之作废
+        # （保存和复制时已还原为 data URI，不再需要它们）
+        self._formula_meta.clear()
+        self._formula_png_base64.clear()
+        
         # 先设置HTML
         self.text_edit.setHtml(html_content)
 
-        try:
+        has_attachment_url = "attachment://" in (html_content or "")
+        if logger.isEnabledFor(logging.DEBUG):
             logger.debug(
                 "[attachment-remark] setHtml called note_id=%s html_len=%s plain_len=%s has_attachment_url=%s tag=%s",
-                getattr(self, "current_note_id", None),
+                self.current_note_id,
                 len(html_content or ""),
                 len(self.text_edit.toPlainText() or ""),
-                ("attachment://" in (html_content or "")),
-                getattr(self.text_edit, "_attachment_tag_name", None),
+                has_attachment_url,
+                self.text_edit._attachment_tag_id,
             )
-        except Exception:
-            pass
 
         # 重新打标记：附件块的 QTextCharFormat 自定义属性不会持久化到 HTML。
         # 因此应用重启后加载笔记时，需要根据 HTML 中的 attachment:// 链接重新识别附件块，
-        # 使其在 Delete/Backspace 时仍能整体删除。
-        try:
-            self._remark_attachment_blocks_after_load()
-        except Exception as e:
-            logger.exception("[attachment-remark] remark failed: %s", e)
+        # 使其在 Delete/Backspace 时仍能整体删除。没有附件链接的笔记（最常见）无需遍历文档。
+        if has_attachment_url:
+            try:
+                self._remark_attachment_blocks_after_load()
+            except Exception as e:
+                logger.exception("[attachment-remark] remark failed: %s", e)
         
-        # 重新渲染所有数学公式
-        self.rerender_formulas()
+        # 数学公式不再在加载时全部重新渲染：只登记旧格式公式图片，
+        # 由 loadResource 在图片首次绘制（进入视口）时渲染
+        self._collect_legacy_formulas(html_content)
 
     def _remark_attachment_blocks_after_load(self):
         """扫描文档，给附件展示块重新打标记（用于整体删除）。
@@ -2609,27 +3267,52 @@ class NoteEditor(QWidget):
         matched_blocks = 0
         marked_chars = 0
         
+        # 一次遍历找出所有附件片段：块内片段没有附件链接时直接跳过，不再逐块导出 HTML
+        ranges = []
         block = doc.firstBlock()
         while block.isValid():
             total_blocks += 1
             
-            if self._block_has_attachment(block, doc):
+            segments = self._find_attachment_segments_in_block(block, doc)
+            if segments:
                 matched_blocks += 1
-                marked_chars += self._mark_attachment_segments_in_block(block, doc)
+                ranges.extend(segments)
             
             block = block.next()
         
-        # 验证标记结果
-        tagged_chars = self._verify_tagged_chars(doc)
-        
-        logger.debug(
-            "[attachment-remark] done blocks_total=%s blocks_matched=%s marked_chars=%s "
-            "tagged_chars=%s",
-            total_blocks,
-            matched_blocks,
-            marked_chars,
-            tagged_chars,
-        )
+        # 合并相邻范围后统一打标记：复用一个光标，并放在同一个编辑块里
+        if ranges:
+            ranges.sort()
+            merged = [list(ranges[0])]
+            for seg_start, seg_end in ranges[1:]:
+                if seg_start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], seg_end)
+                else:
+                    merged.append([seg_start, seg_end])
+            
+            mark_cursor = QTextCursor(doc)
+            mark_format = QTextCharFormat()
+            mark_format.setObjectType(self.text_edit.ATTACHMENT_OBJECT_TYPE)
+            apply_mark = self._apply_attachment_mark
+            mark_cursor.beginEditBlock()
+            try:
+                for seg_start, seg_end in merged:
+                    apply_mark(doc, seg_start, seg_end, mark_cursor, mark_format)
+                    marked_chars += max(0, (seg_end + 1) - seg_start)
+            finally:
+                mark_cursor.endEditBlock()
+        
+        # 验证标记结果（全文扫描，仅调试时执行）
+        if logger.isEnabledFor(logging.DEBUG):
+            tagged_chars = self._verify_tagged_chars(doc)
+            logger.debug(
+                "[attachment-remark] done blocks_total=%s blocks_matched=%s marked_chars=%s "
+                "tagged_chars=%s",
+                total_blocks,
+                matched_blocks,
+                marked_chars,
+                tagged_chars,
+            )
     
     def _is_attachment_anchor_at(self, doc, position: int) -> bool:
         """检查指定位置是否是附件anchor。
@@ -2637,18 +3320,17 @@ class NoteEditor(QWidget):
         采用选中字符再检查格式的方式，避免丢失第一个字符。
         """
         try:
-            if position < 0 or position > max(0, doc.characterCount() - 1):
-                return False
-
-            cf = _selected_char_format(doc, position)
+            # 编辑器自身文档复用其探测光标（越界检查也在 _char_format_at 中完成）
+            cur = None if doc is self.text_edit.document() else QTextCursor(doc)
+            cf = self.text_edit._char_format_at(position, cur)
             if cf is None or not cf.isAnchor():
                 return False
             
             href = cf.anchorHref() or ""
             is_attachment = href.startswith("attachment://")
             
-            if is_attachment:
-                # 获取该位置的字符
+            if is_attachment and logger.isEnabledFor(logging.DEBUG):
+                # 获取该位置的字符（会另建光标选中读取，仅调试时做）
                 char = self._char_at(doc, position)
                 logger.debug(
                     "[attachment-anchor] found at pos=%s char=%r href=%s",
@@ -2676,40 +3358,35 @@ class NoteEditor(QWidget):
         except Exception:
             return False
     
-    def _block_has_attachment(self, block, doc) -> bool:
-        """检查block是否包含附件。
-        扫描 block 的 fragment HTML 是否包含 `attachment://`
-        """
-        block_cursor = QTextCursor(block)
-        block_cursor.select(QTextCursor.SelectionType.BlockUnderCursor)
-        try:
-            block_html = block_cursor.selection().toHtml() or ""
-        except Exception:
-            block_html = ""
-        
-        return "attachment://" in block_html
-    
-    def _mark_attachment_segments_in_block(self, block, doc) -> int:
-        """在block内找出所有附件anchor的连续片段，并对每个片段单独打标。
+    def _find_attachment_segments_in_block(self, block, doc) -> list:
+        """在block内找出所有附件anchor的连续片段（由调用方统一打标）。
         
-        返回：标记的字符数
+        返回：[(seg_start, seg_end), ...]，seg_end 为 inclusive
         """
-        marked_chars = 0
+        segments = []
         
         try:
-            block_start = block.position()
-            block_inclusive = min(max(0, doc.characterCount() - 1), max(0, block_start + block.length() - 1))
-            
-            i = block_start
-            while i <= block_inclusive:
-                if not self._is_attachment_anchor_at(doc, i):
-                    i += 1
-                    continue
-                
+            # 先按片段建出片段表并找出附件链接的起点（整段跳过普通文本），打标记前收集完毕，避免边改边遍历
+            fragments = []
+            starts = []
+            for f_start, length, cf in _iter_fragments(block):
+                is_attachment = cf.isAnchor() and cf.anchorHref().startswith("attachment://")
+                if is_attachment and not (fragments and fragments[-1][2]):
+                    starts.append(len(fragments))
+                fragments.append((f_start, f_start + length, is_attachment))
+            if not starts:
+                return segments
+            
+            sep_pos = block.position() + block.length() - 1
+            block_inclusive = min(max(0, doc.characterCount() - 1), max(0, sep_pos))
+            
+            for k in starts:
                 # 直接使用_find_attachment_segment_bounds查找附件的完整范围
                 # 这个函数会找到：anchor文本 + size文本 + 尾随分隔空格
                 # 不依赖已有的标记，适用于重启后的重新标记场景
-                seg_start, seg_end = self._find_attachment_segment_bounds(doc, i, block_start, block_inclusive)
+                seg_start, seg_end = self._find_attachment_segment_bounds(
+                    doc, fragments, k, block_inclusive
+                )
                 
                 # 日志：输出找到的附件范围
                 logger.debug(
@@ -2719,68 +3396,81 @@ class NoteEditor(QWidget):
                     seg_end - seg_start + 1,
                 )
                 
-                # 对完整范围打标记
-                self._apply_attachment_mark(doc, seg_start, seg_end)
-                
-                marked_chars += max(0, (seg_end + 1) - seg_start)
-                
-                # 跳过该片段，继续查找下一个附件
-                i = seg_end + 1
-            
-            # 获取block_html用于日志
-            block_cursor = QTextCursor(block)
-            block_cursor.select(QTextCursor.SelectionType.BlockUnderCursor)
-            try:
-                block_html = block_cursor.selection().toHtml() or ""
-            except Exception:
-                block_html = ""
+                segments.append((seg_start, seg_end))
             
-            logger.debug(
-                "[attachment-remark] marked block=%s marked_start_pos=%s len=%s html_has_attachment=%s marked_chars=%s",
-                block.blockNumber(),
-                seg_start,
-                seg_end + 1,
-                ("attachment://" in block_html),
-                marked_chars,
-            )
+            # 获取block_html用于日志（序列化代价高，仅在 DEBUG 下进行）
+            if logger.isEnabledFor(logging.DEBUG):
+                block_cursor = QTextCursor(block)
+                block_cursor.select(QTextCursor.SelectionType.BlockUnderCursor)
+                try:
+                    block_html = block_cursor.selection().toHtml() or ""
+                except Exception:
+                    block_html = ""
+                
+                logger.debug(
+                    "[attachment-remark] found block=%s last_start_pos=%s len=%s html_has_attachment=%s segments=%s",
+                    block.blockNumber(),
+                    seg_start,
+                    seg_end + 1,
+                    ("attachment://" in block_html),
+                    len(segments),
+                )
         
         except Exception as e:
-            logger.debug("[attachment-remark] mark block failed: %s", e)
+            logger.debug("[attachment-remark] scan block failed: %s", e)
         
-        return marked_chars
+        return segments
     
-    def _find_attachment_segment_bounds(self, doc, start_pos: int, block_start: int, block_end: int) -> tuple:
+    def _find_attachment_segment_bounds(self, doc, fragments: list, k: int, block_end: int) -> tuple:
         """找到附件片段的起始和结束位置。
         
         包括：anchor文本 + size文本 + 尾随分隔空格
+        fragments: 块内片段表 [(起点, 终点(不含), 是否附件anchor)]，k 为附件起始片段的下标
+        同一片段内字符格式相同，按片段整体向两侧跳跃扩展，不再逐字符读格式
+        block_end: 可纳入范围的最大位置（inclusive）
         
         返回：(seg_start, seg_end) inclusive
         """
-        # anchor 起点（向左扩展同 href 的连续范围）
-        seg_start = start_pos
-        while seg_start > block_start and self._is_attachment_anchor_at(doc, seg_start - 1):
-            seg_start -= 1
-        
-        # anchor 终点（向右扩展同 href 的连续范围）
-        seg_end = start_pos
-        while seg_end < block_end and self._is_attachment_anchor_at(doc, seg_end + 1):
+        # anchor 起点（向左扩展连续的附件片段，块内片段首尾相接）
+        first = k
+        while first > 0 and fragments[first - 1][2]:
+            first -= 1
+        
+        # anchor 终点（向右扩展连续的附件片段）
+        last = k
+        while last + 1 < len(fragments) and fragments[last + 1][2]:
+            last += 1
+        
+        seg_start = fragments[first][0]
+        seg_end = fragments[last][1] - 1
+        
+        # 最后一个片段之后是段落分隔符，它不属于任何片段，单独读一次格式
+        if last == len(fragments) - 1 and seg_end < block_end and self._is_attachment_anchor_at(doc, seg_end + 1):
             seg_end += 1
 
         return seg_start, seg_end
     
-    def _apply_attachment_mark(self, doc, seg_start: int, seg_end: int):
+    def _apply_attachment_mark(
+        self,
+        doc,
+        seg_start: int,
+        seg_end: int,
+        mark_cursor: QTextCursor | None = None,
+        mark_format: QTextCharFormat | None = None,
+    ):
         """对指定范围应用附件标记。
         
         参数：
             seg_start: 起始位置（inclusive）
             seg_end: 结束位置（inclusive）
+            mark_cursor: 可复用的光标（批量打标记时传入）
+            mark_format: 可复用的标记格式（批量打标记时传入）
         """
-        mark_format = QTextCharFormat()
-        mark_format.setProperty(
-            self.text_edit.ATTACHMENT_TAG_PROP,
-            self.text_edit._attachment_tag_name,
-        )
-        mark_cursor = QTextCursor(doc)
+        if mark_format is None:
+            mark_format = QTextCharFormat()
+            mark_format.setObjectType(self.text_edit.ATTACHMENT_OBJECT_TYPE)
+        if mark_cursor is None:
+            mark_cursor = QTextCursor(doc)
         _select_range(mark_cursor, seg_start, seg_end + 1)
         mark_cursor.mergeCharFormat(mark_format)
     
@@ -2791,14 +3481,24 @@ class NoteEditor(QWidget):
         """
         tagged_chars = 0
         try:
-            doc_len = doc.characterCount()
-            max_pos = max(0, doc_len - 1)
-            for i in range(max_pos + 1):
-                cf = _selected_char_format(doc, i)
-                if ( cf is not None and cf.hasProperty(self.text_edit.ATTACHMENT_TAG_PROP)
-                    and cf.property(self.text_edit.ATTACHMENT_TAG_PROP) == self.text_edit._attachment_tag_name
-                ):
-                    tagged_chars += 1
+            # 按块/片段遍历，同一片段内的字符格式相同，整段累加长度
+            object_type = self.text_edit.ATTACHMENT_OBJECT_TYPE
+            char_format_at = self.text_edit._char_format_at
+            # 编辑器自身文档复用其探测光标
+            cur = None if doc is self.text_edit.document() else QTextCursor(doc)
+            max_pos = max(0, doc.characterCount() - 1)
+            block = doc.firstBlock()
+            while block.isValid():
+                for _, length, cf in _iter_fragments(block):
+                    if cf.objectType() == object_type:
+                        tagged_chars += length
+                # 段落分隔符不属于任何片段，单独检查
+                sep_pos = block.position() + block.length() - 1
+                if sep_pos < max_pos:
+                    cf = char_format_at(sep_pos, cur)
+                    if cf is not None and cf.objectType() == object_type:
+                        tagged_chars += 1
+                block = block.next()
         except Exception as e:
             logger.debug("[attachment-remark] verify scan failed: %s", e)
         
@@ -2862,11 +3562,25 @@ class NoteEditor(QWidget):
         self.text_edit.setTextCursor(cursor)
         self.text_edit.setCurrentCharFormat(title_fmt)
     
+    def flush_title_format_update(self):
+        """立即执行排队中的标题/输入格式检查（键盘输入前调用，保证新输入的字符使用正确格式）"""
+        if self._title_format_timer.isActive():
+            self.update_title_and_input_format()
+    
+    def _invalidate_first_line_state(self, position, chars_removed, chars_added):
+        """文档变化落在第一行时，清除第一行标题格式的检查缓存"""
+        if position < self.text_edit.document().firstBlock().length():
+            self._first_line_title_ok = None
+    
     def _is_first_line_title_formatted(self, first_block):
         """检查第一行是否已经是标题格式（28号字体）"""
-        first_cursor = QTextCursor(first_block)
-        first_cursor.select(QTextCursor.SelectionType.BlockUnderCursor)
-        char_fmt = first_cursor.charFormat()
+        # 与选中整行后读 charFormat 一致：取行内最后一个字符（最后一个片段）的格式，空行取块字符格式；
+        # 直接读片段，不再为这次只读检查新建光标和选区
+        char_fmt = None
+        for _, _, char_fmt in _iter_fragments(first_block):
+            pass
+        if char_fmt is None:
+            char_fmt = first_block.charFormat()
         return char_fmt.fontPointSize() == 28
     
     def _apply_title_format_to_first_line(self, first_block):
@@ -2916,9 +3630,13 @@ class NoteEditor(QWidget):
         2. 确保第一行为标题格式（28pt 粗体）
         3. 根据光标位置设置输入格式（标题或正文）
         """
-        # Debug: 打印调用栈
-        logger.debug("=== update_title_and_input_format called ===")
-        logger.debug("Backtrace:\n%s", ''.join(traceback.format_stack()))
+        # 直接调用时取消已排队的合并检查
+        self._title_format_timer.stop()
+        
+        # Debug: 打印调用栈（格式化调用栈开销大，只在调试时执行）
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("=== update_title_and_input_format called ===")
+            logger.debug("Backtrace:\n%s", ''.join(traceback.format_stack()))
         
         document = self.text_edit.document()
         
@@ -2943,8 +3661,12 @@ class NoteEditor(QWidget):
             return
         
         # 格式化第一行为标题格式（如果需要），防御因历史数据、粘贴内容、用户错误操作、程序bug等导致的标题没有格式化的相关问题
-        if not self._is_first_line_title_formatted(first_block):
-            self._apply_title_format_to_first_line(first_block)
+        # 第一行没有变化时沿用上次的检查结果，光标在正文中移动/输入不再重复选中第一行
+        if not self._first_line_title_ok:
+            if self._is_first_line_title_formatted(first_block):
+                self._first_line_title_ok = True
+            else:
+                self._apply_title_format_to_first_line(first_block)
         
         # 根据光标位置设置当前输入格式
         if current_block_number == 0:
@@ -2963,13 +3685,8 @@ class NoteEditor(QWidget):
         current_weight = current_fmt.fontWeight()
         
         # 判断当前是否已经是该标题格式
-        is_current_format = False
-        if level == 1 and current_size == 28 and current_weight == QFont.Weight.Bold:
-            is_current_format = True
-        elif level == 2 and current_size == 22 and current_weight == QFont.Weight.Bold:
-            is_current_format = True
-        elif level == 3 and current_size == 18 and current_weight == QFont.Weight.Bold:
-            is_current_format = True
+        target_size = _HEADING_SIZES.get(level)
+        is_current_format = current_size == target_size and current_weight == QFont.Weight.Bold
         
         cursor.beginEditBlock()
         
@@ -2983,13 +3700,8 @@ class NoteEditor(QWidget):
             # 设置字符格式
             char_fmt = QTextCharFormat()
             char_fmt.setFontWeight(QFont.Weight.Bold)
-            
-            if level == 1:  # 标题（首行标题格式）
-                char_fmt.setFontPointSize(28)
-            elif level == 2:  # 小标题
-                char_fmt.setFontPointSize(22)
-            elif level == 3:  # 副标题
-                char_fmt.setFontPointSize(18)
+            if target_size is not None:
+                char_fmt.setFontPointSize(target_size)
             
             cursor.mergeBlockFormat(block_fmt)
             cursor.mergeCharFormat(char_fmt)
@@ -3009,35 +3721,23 @@ class NoteEditor(QWidget):
     def toggle_bold(self):
         """切换粗体"""
         cursor = self.text_edit.textCursor()
-        fmt = cursor.charFormat()
-        
-        if fmt.fontWeight() == QFont.Weight.Bold:
-            fmt.setFontWeight(QFont.Weight.Normal)
-        else:
-            fmt.setFontWeight(QFont.Weight.Bold)
-        
-        cursor.mergeCharFormat(fmt)
+        is_bold = cursor.charFormat().fontWeight() == QFont.Weight.Bold
+        cursor.mergeCharFormat(self._fmt_bold[not is_bold])
     
     def toggle_italic(self):
         """切换斜体"""
         cursor = self.text_edit.textCursor()
-        fmt = cursor.charFormat()
-        fmt.setFontItalic(not fmt.fontItalic())
-        cursor.mergeCharFormat(fmt)
+        cursor.mergeCharFormat(self._fmt_italic[not cursor.charFormat().fontItalic()])
     
     def toggle_underline(self):
         """切换下划线"""
         cursor = self.text_edit.textCursor()
-        fmt = cursor.charFormat()
-        fmt.setFontUnderline(not fmt.fontUnderline())
-        cursor.mergeCharFormat(fmt)
+        cursor.mergeCharFormat(self._fmt_underline[not cursor.charFormat().fontUnderline()])
     
     def toggle_strikethrough(self):
         """切换删除线"""
         cursor = self.text_edit.textCursor()
-        fmt = cursor.charFormat()
-        fmt.setFontStrikeOut(not fmt.fontStrikeOut())
-        cursor.mergeCharFormat(fmt)
+        cursor.mergeCharFormat(self._fmt_strikeout[not cursor.charFormat().fontStrikeOut()])
     
     def choose_text_color(self):
         """选择字体颜色"""
@@ -3143,27 +3843,38 @@ class NoteEditor(QWidget):
         # 获取当前字体大小和粗细
         font_size = fmt.fontPointSize()
         font_weight = fmt.fontWeight()
+        current_list = cursor.currentList()
+        list_style = current_list.format().style() if current_list else None
+        
+        # 格式与上次相同时勾选状态无需改写
+        state = (font_size, font_weight, fmt.fontItalic(), fmt.fontUnderline(), fmt.fontStrikeOut(), list_style)
+        if state == self._last_menu_state:
+            return
         
         # 更新标题状态
-        self.title_action.setChecked(font_size == 28 and font_weight == QFont.Weight.Bold)
-        self.heading_action.setChecked(font_size == 22 and font_weight == QFont.Weight.Bold)
-        self.subheading_action.setChecked(font_size == 18 and font_weight == QFont.Weight.Bold)
+        is_bold = font_weight == QFont.Weight.Bold
+        for action, level in (
+            (self.title_action, 1),
+            (self.heading_action, 2),
+            (self.subheading_action, 3),
+        ):
+            action.setChecked(is_bold and font_size == _HEADING_SIZES[level])
         
         # 更新文本样式状态
-        self.bold_action.setChecked(font_weight == QFont.Weight.Bold)
-        self.italic_action.setChecked(fmt.fontItalic())
-        self.underline_action.setChecked(fmt.fontUnderline())
-        self.strikethrough_action.setChecked(fmt.fontStrikeOut())
+        self.bold_action.setChecked(is_bold)
+        self.italic_action.setChecked(state[2])
+        self.underline_action.setChecked(state[3])
+        self.strikethrough_action.setChecked(state[4])
         
         # 更新列表状态
-        current_list = cursor.currentList()
-        if current_list:
-            list_style = current_list.format().style()
-            self.bullet_action.setChecked(list_style == QTextListFormat.Style.ListDisc)
-            self.number_action.setChecked(list_style == QTextListFormat.Style.ListDecimal)
-        else:
-            self.bullet_action.setChecked(False)
-            self.number_action.setChecked(False)
+        self.bullet_action.setChecked(list_style == QTextListFormat.Style.ListDisc)
+        self.number_action.setChecked(list_style == QTextListFormat.Style.ListDecimal)
+        
+        self._last_menu_state = state
+    
+    def _invalidate_menu_state(self, *args):
+        """格式菜单中的动作被触发后，下次显示菜单时重新写入勾选状态"""
+        self._last_menu_state = None
     
     def insert_table(self):
         """插入表格（默认 3x3，不弹出对话框）"""
@@ -3215,123 +3926,6 @@ class NoteEditor(QWidget):
             # 调用内部方法处理附件
             self._insert_attachment_with_path(file_path)
     
-    def rerender_formulas(self):
-        """重新渲染文档中的所有数学公式"""
-        # **关键修复**：现在公式是通过 insertImage() 插入的真正图片字符（U+FFFC）
-        # 元数据存储在图片名称中（格式：data:image/png;base64,...|||MATH:type:code）
-        # 需要遍历文档中的所有图片字符，找到公式并重新渲染
-        
-        cursor = QTextCursor(self.text_edit.document())
-        cursor.movePosition(QTextCursor.MoveOperation.Start)
-        
-        # 收集所有需要重新渲染的公式
-        formulas_to_rerender = []  # [(position, formula_type, code, width, height), ...]
-        
-        while not cursor.atEnd():
-            # 保存当前位置
-            current_pos = cursor.position()
-            
-            # 向右移动一个字符并选中
-            _select_char_at(cursor, cursor.position())
-            char_format = cursor.charFormat()
-            selected_text = cursor.selectedText()
-            
-            # 检查是否是真正的图片字符
-            if char_format.isImageFormat() and selected_text == '\ufffc':
-                img_format = char_format.toImageFormat()
-                image_name = img_format.name()
-                
-                # 检查是否是公式（包含 |||MATH: 分隔符）
-                if '|||MATH:' in image_name:
-                    parts = image_name.split('|||', 1)
-                    if len(parts) == 2:
-                        metadata = parts[1]  # MATH:type:code
-                        
-                        # 解析元数据
-                        if metadata.startswith('MATH:'):
-                            metadata_parts = metadata[5:].split(':', 1)  # 去掉 'MATH:' 前缀
-                            if len(metadata_parts) == 2:
-                                formula_type = metadata_parts[0]
-                                escaped_code = metadata_parts[1]
-                                # 反转义HTML实体
-                                code = html.unescape(escaped_code)
-                                
-                                # 保存公式信息
-                                formulas_to_rerender.append((
-                                    current_pos,
-                                    formula_type,
-                                    code,
-                                    img_format.width(),
-                                    img_format.height()
-                                ))
-            
-            # 清除选区
-            cursor.clearSelection()
-        
-        # 如果没有公式需要重新渲染，直接返回
-        if not formulas_to_rerender:
-            return
-        
-        # 开始编辑块
-        edit_cursor = QTextCursor(self.text_edit.document())
-        edit_cursor.beginEditBlock()
-        
-        # 从后往前处理，避免位置偏移
-        for pos, formula_type, code, width, height in reversed(formulas_to_rerender):
-            # 重新渲染公式
-            image_data = self.math_renderer.render(code, formula_type)
-            
-            if image_data and not image_data.isNull():
-                try:
-                    from PIL import Image as PILImage
-                    import io
-                    
-                    # 将 QImage 转换为 PIL Image
-                    new_width = image_data.width()
-                    new_height = image_data.height()
-                    
-                    image_data = image_data.convertToFormat(QImage.Format.Format_RGBA8888)
-                    ptr = image_data.constBits()
-                    ptr.setsize(image_data.sizeInBytes())
-                    
-                    pil_image = PILImage.frombytes('RGBA', (new_width, new_height), bytes(ptr), 'raw', 'RGBA', 0, 1)
-                    
-                    if pil_image.mode == 'RGBA':
-                        background = PILImage.new('RGB', pil_image.size, (255, 255, 255))
-                        background.paste(pil_image, mask=pil_image.split()[3])
-                        pil_image = background
-                    
-                    buffer = io.BytesIO()
-                    pil_image.save(buffer, format='PNG', optimize=True)
-                    image_bytes = buffer.getvalue()
-                    
-                    image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-                    
-                    # 重新组合图片名称（保留元数据）
-                    escaped_code = html.escape(code)
-                    new_image_name = f"data:image/png;base64,{image_base64}|||MATH:{formula_type}:{escaped_code}"
-                    
-                    # 删除旧图片
-                    _select_char_at(edit_cursor, pos)
-                    edit_cursor.removeSelectedText()
-                    
-                    # 插入新图片（保持原尺寸）
-                    new_format = QTextImageFormat()
-                    new_format.setName(new_image_name)
-                    new_format.setWidth(width)
-                    new_format.setHeight(height)
-                    # 设置垂直对齐方式为AlignBaseline，使图片底部与文本基线对齐
-                    new_format.setVerticalAlignment(QTextCharFormat.VerticalAlignment.AlignBaseline)
-                    edit_cursor.insertImage(new_format)
-                    
-                except Exception as e:
-                    print(f"重新渲染公式失败: {e}")
-                    import traceback
-                    traceback.print_exc()
-        
-        # 结束编辑块
-        edit_cursor.endEditBlock()
-    
     def insert_image_to_editor(self, image):
         """插入图片到编辑器"""
         # 检查图片是否有效
@@ -3340,10 +3934,8 @@ class NoteEditor(QWidget):
             return
         
         # 限制图片大小
-        max_width = 800
-        
-        if image.width() > max_width:
-            image = image.scaledToWidth(max_width, Qt.TransformationMode.SmoothTransformation)
+        if image.width() > _MAX_IMAGE_WIDTH:
+            image = image.scaledToWidth(_MAX_IMAGE_WIDTH, Qt.TransformationMode.SmoothTransformation)
         
         # 再次检查缩放后的图片
         if image.isNull():
@@ -3351,38 +3943,11 @@ class NoteEditor(QWidget):
             return
         
         try:
-            from PIL import Image as PILImage
-            import io
-            
-            # 将 QImage 转换为 PIL Image，完全避免使用 Qt 的 save 方法
-            # 获取图片的宽度、高度和格式
             width = image.width()
             height = image.height()
             
-            # 转换为 RGBA8888 格式（PIL 兼容）
-            image = image.convertToFormat(QImage.Format.Format_RGBA8888)
-            
-            # 获取图片的原始字节数据
-            ptr = image.constBits()
-            ptr.setsize(image.sizeInBytes())
-            
-            # 使用 PIL 从原始字节创建图片
-            pil_image = PILImage.frombytes('RGBA', (width, height), bytes(ptr), 'raw', 'RGBA', 0, 1)
-            
-            # 转换为 RGB（去除 alpha 通道，PNG 更小）
-            if pil_image.mode == 'RGBA':
-                # 创建白色背景
-                background = PILImage.new('RGB', pil_image.size, (255, 255, 255))
-                background.paste(pil_image, mask=pil_image.split()[3])  # 使用 alpha 通道作为 mask
-                pil_image = background
-            
-            # 使用 PIL 保存为 PNG 格式到内存
-            buffer = io.BytesIO()
-            pil_image.save(buffer, format='PNG', optimize=True)
-            image_bytes = buffer.getvalue()
-            
-            # 转换为 base64
-            image_data = base64.b64encode(image_bytes).decode('utf-8')
+            # 用 Qt 在白色背景上合成（去除 alpha 通道），再以快速压缩编码为PNG并转为base64
+            image_data = _encode_png_base64(_flatten_on_white(image))
             
             # 生成唯一的图片名称
             image_name = f"image_{uuid.uuid4().hex[:8]}.png"
@@ -3391,29 +3956,51 @@ class NoteEditor(QWidget):
             cursor = self.text_edit.textCursor()
             
             # 使用QTextImageFormat插入图片（更可靠的方式）
-            image_format = QTextImageFormat()
+            image_format = QTextImageFormat(self._img_fmt_proto)
             image_format.setName(f"data:image/png;base64,{image_data}")
             image_format.setWidth(width)
             image_format.setHeight(height)
-            # 设置垂直对齐方式为AlignBaseline，使图片底部与文本基线对齐
-            image_format.setVerticalAlignment(QTextCharFormat.VerticalAlignment.AlignBaseline)
             
             # 插入图片
             cursor.insertImage(image_format)
             
         except Exception as e:
             print(f"插入图片时发生错误: {e}")
-            import traceback
             traceback.print_exc()
     
+    def insert_image_from_bytes(self, data: bytes, mime: str) -> bool:
+        """插入已编码的图片字节
+
+        PNG 且无 alpha 通道（颜色类型不是 4/6）、宽度不超限时，直接把原始字节
+        base64 嵌入，跳过 RGBA 转换、白底合成和 PNG 重新编码；其余情况解码后
+        交给 insert_image_to_editor 走常规流程。
+
+        Returns:
+            bool: 是否插入成功
+        """
+        info = _png_header_info(data) if mime == "image/png" else None
+        if info is not None:
+            width, height, color_type = info
+            if color_type not in (4, 6) and 0 < width <= _MAX_IMAGE_WIDTH and height > 0:
+                image_format = QTextImageFormat(self._img_fmt_proto)
+                image_format.setName(f"data:image/png;base64,{base64.b64encode(data).decode('ascii')}")
+                image_format.setWidth(width)
+                image_format.setHeight(height)
+                self.text_edit.textCursor().insertImage(image_format)
+                return True
+
+        image = QImage.fromData(data)
+        if image.isNull():
+            return False
+        self.insert_image_to_editor(image)
+        return True
+    
     def _format_file_size(self, file_size):
         """格式化文件大小为可读字符串"""
-        if file_size < 1024:
-            return f"{file_size} B"
-        elif file_size < 1024 * 1024:
-            return f"{file_size / 1024:.1f} KB"
-        else:
-            return f"{file_size / (1024 * 1024):.1f} MB"
+        for divisor, suffix in _SIZE_UNITS:
+            if file_size >= divisor:
+                return f"{file_size / divisor:.1f} {suffix}"
+        return f"{file_size} B"
     
     def _add_attachment_to_manager(self, file_path, file_name, file_size):
         """将附件添加到附件管理器
@@ -3430,13 +4017,23 @@ class NoteEditor(QWidget):
         
         return True, attachment_id
     
-    def _create_attachment_html(self, attachment_id, file_name, size_str):
-        """创建附件的HTML代码"""
-        attachment_url = f"attachment://{attachment_id}"
-        return f'<a href="{attachment_url}" style="color: #0066cc;">{file_name} ({size_str})</a>'
+    def _create_attachment_format(self, attachment_id):
+        """创建附件链接的字符格式（与 <a href="attachment://id" style="color: #0066cc;"> 导入后的格式一致）
+        
+        同时带上附件标记，插入时一次写入，不必事后再 mergeCharFormat 打标记
+        """
+        fmt = QTextCharFormat()
+        fmt.setAnchor(True)
+        fmt.setAnchorHref(f"attachment://{attachment_id}")
+        fmt.setForeground(QColor("#0066cc"))
+        fmt.setFontUnderline(True)
+        fmt.setObjectType(self.text_edit.ATTACHMENT_OBJECT_TYPE)
+        return fmt
     
     def _log_attachment_insert_before(self, start_pos, file_name, size_str, attachment_id):
         """记录附件插入前的日志"""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         try:
             doc = self.text_edit.document()
             doc_len = int(doc.characterCount())
@@ -3455,6 +4052,8 @@ class NoteEditor(QWidget):
     
     def _log_attachment_insert_after(self, end_pos, start_pos):
         """记录附件插入后的日志"""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         try:
             doc = self.text_edit.document()
             doc_len = int(doc.characterCount())
@@ -3469,43 +4068,16 @@ class NoteEditor(QWidget):
         except Exception:
             pass
     
-    def _mark_inserted_attachment(self, doc, start_pos, end_pos):
-        """对插入的附件打标记"""
-        if end_pos <= start_pos:
-            return
-        
-        mark_cursor = QTextCursor(doc)
-        _select_range(mark_cursor, start_pos, end_pos)
-        
-        try:
-            logger.debug(
-                "[attachment-insert][mark][before] start_pos=%s end_pos=%s doc_len=%s start_char=%s",
-                start_pos,
-                end_pos,
-                int(doc.characterCount()),
-                _dump_doc_chars(doc, start_pos, min(end_pos - 1, start_pos)),
-            )
-        except Exception:
-            pass
-        
-        mark_format = QTextCharFormat()
-        mark_format.setProperty(
-            self.text_edit.ATTACHMENT_TAG_PROP,
-            self.text_edit._attachment_tag_name,
-        )
-        mark_cursor.mergeCharFormat(mark_format)
-        
-        # 验证标记范围
-        self._verify_attachment_mark(doc, start_pos)
-    
     def _verify_attachment_mark(self, doc, start_pos):
         """验证附件标记范围"""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
         try:
             marked = _find_marked_span(
                 doc,
                 start_pos,
                 self.text_edit.ATTACHMENT_TAG_PROP,
-                getattr(self.text_edit, "_attachment_tag_name", ""),
+                self.text_edit._attachment_tag_id,
             )
             if marked is not None:
                 ms, me = marked
@@ -3532,7 +4104,6 @@ class NoteEditor(QWidget):
     def _insert_attachment_with_path(self, file_path):
         """插入附件链接 - 使用附件管理器加密存储"""
         try:
-            import os
             
             # 检查是否有note_manager和当前笔记ID
             if not self.note_manager or not self.current_note_id:
@@ -3549,24 +4120,20 @@ class NoteEditor(QWidget):
             if not success:
                 return
             
-            # 创建附件HTML
-            attachment_html = self._create_attachment_html(attachment_id, file_name, size_str)
+            # 创建附件链接格式
+            attachment_format = self._create_attachment_format(attachment_id)
             
-            # 插入附件HTML
+            # 直接以链接格式插入文本，不经过HTML解析（文件名也不会被当作HTML解释）
             cursor = self.text_edit.textCursor()
             start_pos = cursor.position()
             
             self._log_attachment_insert_before(start_pos, file_name, size_str, attachment_id)
-            cursor.insertHtml(attachment_html)
+            cursor.insertText(f"{file_name} ({size_str})", attachment_format)
             end_pos = cursor.position()
             self._log_attachment_insert_after(end_pos, start_pos)
             
-            # 标记插入的附件
-            try:
-                doc = self.text_edit.document()
-                self._mark_inserted_attachment(doc, start_pos, end_pos)
-            except Exception:
-                pass
+            # 附件标记已随插入格式写入，这里只做调试验证
+            self._verify_attachment_mark(self.text_edit.document(), start_pos)
             
             # 重置光标格式
             self._reset_cursor_format(cursor)
@@ -3575,7 +4142,6 @@ class NoteEditor(QWidget):
             
         except Exception as e:
             print(f"插入附件时发生错误: {e}")
-            import traceback
             traceback.print_exc()
             QMessageBox.critical(self, "错误", f"插入附件失败: {str(e)}")
         
@@ -3595,67 +4161,171 @@ class NoteEditor(QWidget):
             if mathml_code:
                 self.insert_math_formula(mathml_code, 'mathml')
                 
+    def _register_formula_image(self, image, code, formula_type, image_base64=None):
+        """把公式图片登记为文档资源，返回图片名称（formula://id）
+        
+        图片名称不再内嵌整段 base64，公式类型、代码和图片记录在 _formula_meta 中，
+        保存时由 _expand_formula_resources 还原为原有的 data URI 格式。
+        
+        名称取自图片像素和公式内容的哈希：同一公式出现多次时共用一个资源，
+        而像素相同但代码不同的公式仍各自保留自己的元数据。
+        """
+        digest = hashlib.blake2b(f"{formula_type}:{code}".encode('utf-8'), digest_size=16)
+        bits = image.constBits()
+        bits.setsize(image.sizeInBytes())
+        digest.update(memoryview(bits))
+        name = f"{_FORMULA_URL_PREFIX}{digest.hexdigest()}"
+        
+        doc = self.text_edit.document()
+        url = QUrl(name)
+        if doc.resource(QTextDocument.ResourceType.ImageResource.value, url) is None:
+            doc.addResource(QTextDocument.ResourceType.ImageResource, url, image)
+        key = (formula_type, code)
+        if image_base64:
+            self._formula_png_base64.setdefault(key, image_base64)
+        if name not in self._formula_meta:
+            self._formula_meta[name] = (formula_type, code, image)
+            # 只有登记为 formula:// 资源的公式在保存/复制时需要PNG数据：交给线程池提前编码
+            if key not in self._formula_png_base64:
+                task = _FormulaEncodeTask(key, image)
+                task.signals.finished.connect(self._on_formula_encoded)
+                QThreadPool.globalInstance().start(task)
+        return name
+    
+    def get_formula_meta(self, image_name):
+        """返回 formula:// 图片的 (formula_type, code)，不是公式资源时返回None"""
+        meta = self._formula_meta.get(image_name)
+        if meta is None:
+            return None
+        return meta[0], meta[1]
+    
+    def _collect_legacy_formulas(self, html_content):
+        """登记文档中旧格式（data:...|||MATH:type:code）的公式图片，供按需渲染使用"""
+        self._legacy_formulas.clear()
+        if '|||MATH:' not in (html_content or ""):
+            return
+        parse = self.text_edit._parse_math_formula_metadata
+        block = self.text_edit.document().firstBlock()
+        while block.isValid():
+            for _, _, cf in _iter_fragments(block):
+                if cf.isImageFormat():
+                    image_name = cf.toImageFormat().name()
+                    if '|||MATH:' in image_name:
+                        formula_type, code = parse(image_name)
+                        if formula_type and code:
+                            # 以 Qt 加载资源时使用的 URL 字符串为键（QUrl 会对名称做百分号编码）
+                            self._legacy_formulas[QUrl(image_name).toString()] = (formula_type, code)
+            block = block.next()
+    
+    def load_legacy_formula_resource(self, url_string):
+        """按需渲染旧格式公式图片，不是登记过的公式时返回None"""
+        meta = self._legacy_formulas.get(url_string)
+        if meta is None:
+            return None
+        formula_type, code = meta
+        encoded = self._render_and_encode(code, formula_type)
+        return encoded[2] if encoded is not None else None
+    
+    def load_formula_resource(self, image_name):
+        """返回登记的 formula:// 图片（文档资源缓存中没有时使用）"""
+        meta = self._formula_meta.get(image_name)
+        return meta[2] if meta is not None else None
+    
+    def _on_formula_encoded(self, key, image_base64):
+        """后台编码完成：记录公式的PNG数据（公式已不在当前文档中登记时丢弃，避免切换笔记后残留）"""
+        if any(meta[0] == key[0] and meta[1] == key[1] for meta in self._formula_meta.values()):
+            self._formula_png_base64.setdefault(key, image_base64)
+    
+    def _formula_base64(self, formula_type, code, image):
+        """取公式图片的PNG base64；后台编码还没完成时同步编码"""
+        key = (formula_type, code)
+        image_base64 = self._formula_png_base64.get(key)
+        if image_base64 is None:
+            image_base64 = _encode_png_base64(image)
+            self._formula_png_base64[key] = image_base64
+        return image_base64
+    
+    def _expand_formula_resources(self, html_content):
+        """把HTML中的 formula:// 图片还原为 data:image/png;base64,...|||MATH:type:code"""
+        if _FORMULA_URL_PREFIX not in html_content:
+            return html_content
+        
+        def _to_data_uri(match):
+            meta = self._formula_meta.get(match.group(1))
+            if meta is None:
+                return match.group(0)
+            formula_type, code, image = meta
+            image_base64 = self._formula_base64(formula_type, code, image)
+            image_name = f"data:image/png;base64,{image_base64}|||MATH:{formula_type}:{html.escape(code)}"
+            return f'src="{html.escape(image_name)}"'
+        
+        return _FORMULA_SRC_RE.sub(_to_data_uri, html_content)
+    
+    def _render_and_encode(self, code, formula_type):
+        """渲染公式，结果按 (formula_type, code) 做LRU缓存
+        
+        渲染和白底合成在GUI线程完成（matplotlib 不是线程安全的）；
+        PNG/base64 编码在 _register_formula_image 登记资源时才交给线程池，
+        旧格式公式按需绘制时不需要编码。
+        
+        Returns:
+            tuple: (width, height, image)，渲染失败返回None
+        """
+        key = (formula_type, code)
+        cached = self._formula_cache.get(key)
+        if cached is not None:
+            self._formula_cache.move_to_end(key)
+            return cached
+        
+        # 渲染失败（可能只是暂时性错误）不缓存，下次仍会重试
+        image_data = self.math_renderer.render(code, formula_type)
+        if not image_data or image_data.isNull():
+            return None
+        
+        try:
+            width = image_data.width()
+            height = image_data.height()
+            
+            # 直接用 Qt 在白色背景上合成（去除 alpha 通道），不再经过 PIL 逐像素处理
+            flat = _flatten_on_white(image_data)
+            
+        except Exception as e:
+            print(f"公式图片合成失败: {e}")
+            traceback.print_exc()
+            return None
+        
+        encoded = (width, height, flat)
+        self._formula_cache[key] = encoded
+        if len(self._formula_cache) > self._formula_cache_maxsize:
+            self._formula_cache.popitem(last=False)
+        return encoded
+    
     def insert_math_formula(self, code, formula_type):
         """插入数学公式"""
         cursor = self.text_edit.textCursor()
         
-        # 渲染公式为图片
-        image_data = self.math_renderer.render(code, formula_type)
+        # 渲染公式为图片（命中缓存时直接复用）
+        encoded = self._render_and_encode(code, formula_type)
         
-        if image_data and not image_data.isNull():
+        if encoded is not None:
             try:
-                from PIL import Image as PILImage
-                import io
-                
-                # 将 QImage 转换为 PIL Image，完全避免使用 Qt 的 save 方法
-                width = image_data.width()
-                height = image_data.height()
-                
-                # 转换为 RGBA8888 格式（PIL 兼容）
-                image_data = image_data.convertToFormat(QImage.Format.Format_RGBA8888)
-                
-                # 获取图片的原始字节数据
-                ptr = image_data.constBits()
-                ptr.setsize(image_data.sizeInBytes())
-                
-                # 使用 PIL 从原始字节创建图片
-                pil_image = PILImage.frombytes('RGBA', (width, height), bytes(ptr), 'raw', 'RGBA', 0, 1)
-                
-                # 转换为 RGB（去除 alpha 通道）
-                if pil_image.mode == 'RGBA':
-                    background = PILImage.new('RGB', pil_image.size, (255, 255, 255))
-                    background.paste(pil_image, mask=pil_image.split()[3])
-                    pil_image = background
-                
-                # 使用 PIL 保存为 PNG 格式到内存
-                buffer = io.BytesIO()
-                pil_image.save(buffer, format='PNG', optimize=True)
-                image_bytes = buffer.getvalue()
-                
-                # 转换为 base64
-                image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+                width, height, image = encoded
                 
                 # **关键修复**：使用 insertImage() 而不是 insertHtml()
                 # 这样公式会成为真正的图片字符（U+FFFC），可以被点击选中
-                # 在图片名称中编码公式元数据（格式: data:image/png;base64,...|||MATH:type:code）
-                import html
-                escaped_code = html.escape(code)
-                # 使用 ||| 作为分隔符，将元数据附加到图片名称后面
-                image_name = f"data:image/png;base64,{image_base64}|||MATH:{formula_type}:{escaped_code}"
+                # 图片登记为文档资源，名称为短URL，公式元数据保存在 _formula_meta 中
+                image_name = self._register_formula_image(image, code, formula_type)
                 
                 # 使用 QTextImageFormat 插入图片
-                image_format = QTextImageFormat()
+                image_format = QTextImageFormat(self._img_fmt_proto)
                 image_format.setName(image_name)
                 image_format.setWidth(width)
                 image_format.setHeight(height)
-                # 设置垂直对齐方式为AlignBaseline，使公式底部与文本基线对齐
-                image_format.setVerticalAlignment(QTextCharFormat.VerticalAlignment.AlignBaseline)
                 
                 cursor.insertImage(image_format)
                 
             except Exception as e:
                 print(f"插入公式时发生错误: {e}")
-                import traceback
                 traceback.print_exc()
                 # 如果出错，插入原始代码
                 if formula_type == 'latex':
@@ -3686,7 +4356,7 @@ class NoteEditor(QWidget):
             
             if dialog.exec() == QDialog.DialogCode.Accepted:
                 new_code = dialog.get_latex()
-                if new_code and new_code != code:
+                if new_code and new_code.strip() != code.strip():
                     # 用户修改了公式，更新公式图片
                     self._update_formula_image(new_code, formula_type, image_cursor, image_format)
         
@@ -3697,7 +4367,7 @@ class NoteEditor(QWidget):
             
             if dialog.exec() == QDialog.DialogCode.Accepted:
                 new_code = dialog.get_mathml()
-                if new_code and new_code != code:
+                if new_code and new_code.strip() != code.strip():
                     # 用户修改了公式，更新公式图片
                     self._update_formula_image(new_code, formula_type, image_cursor, image_format)
     
@@ -3710,78 +4380,41 @@ class NoteEditor(QWidget):
             image_cursor: 图片字符的光标位置
             old_image_format: 旧的图片格式
         """
-        # 渲染新公式为图片
-        image_data = self.math_renderer.render(code, formula_type)
+        # 公式内容没有变化时不需要重新渲染和修改文档
+        old_type, old_code = self.text_edit._parse_math_formula_metadata(old_image_format.name())
+        if old_type == formula_type and old_code == code:
+            return
+        
+        # 渲染新公式为图片（命中缓存时直接复用）
+        encoded = self._render_and_encode(code, formula_type)
         
-        if image_data and not image_data.isNull():
+        if encoded is not None:
             try:
-                from PIL import Image as PILImage
-                import io
-                
-                # 将 QImage 转换为 PIL Image
-                width = image_data.width()
-                height = image_data.height()
-                
-                image_data = image_data.convertToFormat(QImage.Format.Format_RGBA8888)
-                ptr = image_data.constBits()
-                ptr.setsize(image_data.sizeInBytes())
-                
-                pil_image = PILImage.frombytes('RGBA', (width, height), bytes(ptr), 'raw', 'RGBA', 0, 1)
-                
-                if pil_image.mode == 'RGBA':
-                    background = PILImage.new('RGB', pil_image.size, (255, 255, 255))
-                    background.paste(pil_image, mask=pil_image.split()[3])
-                    pil_image = background
+                width, height, image = encoded
                 
-                buffer = io.BytesIO()
-                pil_image.save(buffer, format='PNG', optimize=True)
-                image_bytes = buffer.getvalue()
+                # 登记新的公式图片资源
+                new_image_name = self._register_formula_image(image, code, formula_type)
                 
-                image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+                # image_cursor 选中的就是公式图片字符（Qt 会随文档编辑自动调整选区）；
+                # 没有选区时把光标位置视为图片字符的起始位置
+                cursor = QTextCursor(image_cursor)
+                if not cursor.hasSelection():
+                    _select_char_at(cursor, cursor.position())
                 
-                # 创建新的图片名称（包含元数据）
-                escaped_code = html.escape(code)
-                new_image_name = f"data:image/png;base64,{image_base64}|||MATH:{formula_type}:{escaped_code}"
-                
-                # 查找真正的图片字符位置
-                old_pos = image_cursor.position()
-                cursor = QTextCursor(self.text_edit.document())
-                real_image_pos = None
-                
-                for offset in range(2):
-                    check_pos = old_pos + offset
-                    
-                    if _select_char_at(cursor, check_pos):
-                        selected_text = cursor.selectedText()
-                        char_format = cursor.charFormat()
-                        
-                        if char_format.isImageFormat() and selected_text == '\ufffc':
-                            real_image_pos = check_pos
-                            break
-                    
-                    cursor.clearSelection()
-                
-                if real_image_pos is None:
+                if not (cursor.charFormat().isImageFormat() and cursor.selectedText() == '\ufffc'):
                     print("错误：找不到图片字符")
                     return
                 
-                # 开始编辑块
-                cursor.beginEditBlock()
-                
-                # 删除旧图片
-                _select_char_at(cursor, real_image_pos)
-                cursor.removeSelectedText()
-                
-                # 插入新图片（保持原尺寸或使用新尺寸）
-                new_format = QTextImageFormat()
+                # 新图片格式（保持原尺寸）
+                new_format = QTextImageFormat(self._img_fmt_proto)
                 new_format.setName(new_image_name)
                 # 保持原图片的尺寸
                 new_format.setWidth(old_image_format.width())
                 new_format.setHeight(old_image_format.height())
-                new_format.setVerticalAlignment(QTextCharFormat.VerticalAlignment.AlignBaseline)
-                cursor.insertImage(new_format)
                 
-                cursor.endEditBlock()
+                # 原地替换图片字符的格式，而不是删除后再插入：
+                # 文档只产生一次格式变更（一次 contentsChange / 重新布局），仍是单个撤销步骤
+                cursor.setCharFormat(new_format)
                 
                 print(f"成功更新公式: {width}x{height}")
                 
@@ -3794,7 +4427,6 @@ class NoteEditor(QWidget):
                 
             except Exception as e:
                 print(f"更新公式时发生错误: {e}")
-                import traceback
                 traceback.print_exc()
                 QMessageBox.warning(self, "错误", f"更新公式失败: {str(e)}")
         else:
@@ -3902,6 +4534,16 @@ class LinkInsertDialog(QDialog):
 class LatexInputDialog(QDialog):
     """LaTeX输入对话框"""
     
+    # 常用公式示例（名称, 代码）
+    EXAMPLES = (
+        ("分数", r"\frac{a}{b}"),
+        ("根号", r"\sqrt{x}"),
+        ("次方", r"x^{2}"),
+        ("求和", r"\sum_{i=1}^{n} x_i"),
+        ("积分", r"\int_{a}^{b} f(x)dx"),
+        ("矩阵", r"\begin{pmatrix} a & b \\ c & d \end{pmatrix}"),
+    )
+    
     def __init__(self, parent=None):
         super().__init__(parent)
         self.init_ui()
@@ -3925,6 +4567,13 @@ class LatexInputDialog(QDialog):
         self.input_edit.setPlaceholderText("例如: x = \\frac{-b \\pm \\sqrt{b^2-4ac}}{2a}")
         self.input_edit.setMaximumHeight(150)
         self.input_edit.textChanged.connect(self.update_preview)
+        
+        # 预览防抖：连续输入时只在停顿后刷新一次预览
+        self._last_preview_code = None
+        self._preview_timer = QTimer(self)
+        self._preview_timer.setSingleShot(True)
+        self._preview_timer.setInterval(150)
+        self._preview_timer.timeout.connect(self._do_preview)
         splitter.addWidget(self.input_edit)
         
         # 预览区域
@@ -3933,6 +4582,10 @@ class LatexInputDialog(QDialog):
         
         self.preview = QTextBrowser()
         self.preview.setMinimumHeight(150)
+        # 预览样式只设置一次；使用系统默认等宽字体栈，避免引用不存在的字体导致Qt做字体回退带来额外耗时
+        self.preview.document().setDefaultStyleSheet(
+            "p.latex { font-family: ui-monospace, Menlo, Monaco, Consolas, \"Liberation Mono\", \"Courier New\", monospace; }"
+        )
         splitter.addWidget(self.preview)
         
         layout.addWidget(splitter)
@@ -3943,18 +4596,9 @@ class LatexInputDialog(QDialog):
         
         examples_layout = QHBoxLayout()
         
-        examples = [
-            ("分数", r"\frac{a}{b}"),
-            ("根号", r"\sqrt{x}"),
-            ("次方", r"x^{2}"),
-            ("求和", r"\sum_{i=1}^{n} x_i"),
-            ("积分", r"\int_{a}^{b} f(x)dx"),
-            ("矩阵", r"\begin{pmatrix} a & b \\ c & d \end{pmatrix}"),
-        ]
-        
-        for name, code in examples:
+        for name, code in self.EXAMPLES:
             btn = QPushButton(name)
-            btn.clicked.connect(lambda checked, c=code: self.insert_example(c))
+            btn.clicked.connect(functools.partial(self.insert_example, code))
             examples_layout.addWidget(btn)
             
         layout.addLayout(examples_layout)
@@ -3979,14 +4623,18 @@ class LatexInputDialog(QDialog):
         self.input_edit.insertPlainText(code)
         
     def update_preview(self):
-        """更新预览"""
+        """更新预览（防抖，实际刷新在 _do_preview 中）"""
+        self._preview_timer.start()
+        
+    def _do_preview(self):
+        """刷新预览"""
         latex_code = self.input_edit.toPlainText()
+        if latex_code == self._last_preview_code:
+            return
+        self._last_preview_code = latex_code
         if latex_code:
-            # 简单预览，显示LaTeX代码
-            # 使用系统默认等宽字体栈，避免引用不存在的字体导致Qt做字体回退带来额外耗时
-            self.preview.setHtml(
-                f"<p style='font-family: ui-monospace, Menlo, Monaco, Consolas, \"Liberation Mono\", \"Courier New\", monospace;'>${latex_code}$</p>"
-            )
+            # 简单预览，显示LaTeX代码（转义 & < >，避免被当成HTML解析）
+            self.preview.setHtml(f"<p class='latex'>${latex_code.translate(_HTML_ESCAPE_TABLE)}$</p>")
         else:
             self.preview.clear()
             
@@ -3998,6 +4646,16 @@ class LatexInputDialog(QDialog):
 class MathMLInputDialog(QDialog):
     """MathML输入对话框"""
     
+    # 常用示例（名称, 代码）
+    EXAMPLES = (
+        ("分数", "<math><mfrac><mi>a</mi><mi>b</mi></mfrac></math>"),
+        ("根号", "<math><msqrt><mi>x</mi></msqrt></math>"),
+        ("次方", "<math><msup><mi>x</mi><mn>2</mn></msup></math>"),
+        ("求和", "<math><munderover><mo>∑</mo><mrow><mi>i</mi><mo>=</mo><mn>1</mn></mrow><mi>n</mi></munderover><msub><mi>x</mi><mi>i</mi></msub></math>"),
+        ("积分", "<math><msubsup><mo>∫</mo><mi>a</mi><mi>b</mi></msubsup><mi>f</mi><mo>(</mo><mi>x</mi><mo>)</mo><mi>d</mi><mi>x</mi></math>"),
+        ("矩阵", "<math><mfenced open='(' close=')'><mtable><mtr><mtd><mi>a</mi></mtd><mtd><mi>b</mi></mtd></mtr><mtr><mtd><mi>c</mi></mtd><mtd><mi>d</mi></mtd></mtr></mtable></mfenced></math>"),
+    )
+    
     def __init__(self, parent=None):
         super().__init__(parent)
         self.init_ui()
@@ -4026,18 +4684,9 @@ class MathMLInputDialog(QDialog):
         
         examples_layout = QHBoxLayout()
         
-        examples = [
-            ("分数", "<math><mfrac><mi>a</mi><mi>b</mi></mfrac></math>"),
-            ("根号", "<math><msqrt><mi>x</mi></msqrt></math>"),
-            ("次方", "<math><msup><mi>x</mi><mn>2</mn></msup></math>"),
-            ("求和", "<math><munderover><mo>∑</mo><mrow><mi>i</mi><mo>=</mo><mn>1</mn></mrow><mi>n</mi></munderover><msub><mi>x</mi><mi>i</mi></msub></math>"),
-            ("积分", "<math><msubsup><mo>∫</mo><mi>a</mi><mi>b</mi></msubsup><mi>f</mi><mo>(</mo><mi>x</mi><mo>)</mo><mi>d</mi><mi>x</mi></math>"),
-            ("矩阵", "<math><mfenced open='(' close=')'><mtable><mtr><mtd><mi>a</mi></mtd><mtd><mi>b</mi></mtd></mtr><mtr><mtd><mi>c</mi></mtd><mtd><mi>d</mi></mtd></mtr></mtable></mfenced></math>"),
-        ]
-        
-        for name, code in examples:
+        for name, code in self.EXAMPLES:
             btn = QPushButton(name)
-            btn.clicked.connect(lambda checked, c=code: self.insert_example(c))
+            btn.clicked.connect(functools.partial(self.insert_example, code))
             examples_layout.addWidget(btn)
             
         layout.addLayout(examples_layout)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试附件整体标记：插入后整体删除，重新加载后重新打标记
+"""
+
+import os
+import sys
+import tempfile
+from PyQt6.QtCore import Qt
+from PyQt6.QtGui import QTextCursor
+from PyQt6.QtTest import QTest
+from PyQt6.QtWidgets import QApplication
+from note_editor import NoteEditor
+from note_manager import NoteManager
+
+
+def _attachment_chars(text_edit):
+    """返回文档中带附件标记的字符位置列表"""
+    doc = text_edit.document()
+    cursor = QTextCursor(doc)
+    marked = []
+    for pos in range(doc.characterCount() - 1):
+        cursor.setPosition(pos)
+        cursor.setPosition(pos + 1, QTextCursor.MoveMode.KeepAnchor)
+        if cursor.charFormat().objectType() == text_edit.ATTACHMENT_OBJECT_TYPE:
+            marked.append(pos)
+    return marked
+
+
+def _press_key_at(text_edit, pos, key):
+    """把光标放到 pos 后按一次 key（删除键只在附件边界上整体删除附件）"""
+    cursor = text_edit.textCursor()
+    cursor.setPosition(pos)
+    text_edit.setTextCursor(cursor)
+    QTest.keyClick(text_edit, key)
+
+
+def test_attachment_marking():
+    """测试附件插入、整体删除和重新加载后的标记"""
+    print("=" * 60)
+    print("测试附件整体标记")
+    print("=" * 60)
+
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    manager = NoteManager()
+    attachment_manager = manager.attachment_manager
+    note_id = manager.create_note(title="附件测试笔记", content="")
+
+    # 准备一个临时附件文件
+    temp_file = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+    temp_file.write("附件内容")
+    temp_file.close()
+    file_name = os.path.basename(temp_file.name)
+
+    try:
+        # 测试1: 插入附件后整段文本都带附件标记
+        print("\n[测试1] 插入附件...")
+        editor = NoteEditor(manager)
+        editor.current_note_id = note_id
+        editor.setHtml("<p>附件测试笔记</p><p>见附件：</p>")
+        prefix = editor.text_edit.toPlainText()
+
+        cursor = editor.text_edit.textCursor()
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        editor.text_edit.setTextCursor(cursor)
+        editor._insert_attachment_with_path(temp_file.name)
+
+        text = editor.text_edit.toPlainText()
+        start = len(prefix)
+        end = len(text)
+        if text[start:].startswith(file_name) and _attachment_chars(editor.text_edit) == list(range(start, end)):
+            print("✓ 附件文本已整体标记")
+        else:
+            print("✗ 附件标记范围错误")
+            return False
+
+        # 测试2: 保存后重新加载，附件标记被重新打上
+        print("\n[测试2] 重新加载笔记...")
+        html_content = editor.toHtml()
+        editor2 = NoteEditor(manager)
+        editor2.current_note_id = note_id
+        editor2.setHtml(html_content)
+
+        if (editor2.text_edit.toPlainText() == text
+                and _attachment_chars(editor2.text_edit) == list(range(start, end))):
+            print("✓ 重新加载后附件仍整体标记")
+        else:
+            print("✗ 重新加载后附件标记丢失")
+            return False
+
+        # 测试3: 在附件末尾按退格键，附件整体删除，前面的文字保持不变
+        print("\n[测试3] 退格删除重新加载的附件...")
+        _press_key_at(editor2.text_edit, end, Qt.Key.Key_Backspace)
+
+        if editor2.text_edit.toPlainText() == prefix and not _attachment_chars(editor2.text_edit):
+            print("✓ 附件已整体删除")
+        else:
+            print("✗ 附件未被整体删除")
+            print(f"  剩余文本: {editor2.text_edit.toPlainText()!r}")
+            return False
+
+        # 测试4: 撤销后附件及其标记恢复，在附件开头按删除键同样整体删除
+        print("\n[测试4] 撤销后用删除键删除附件...")
+        editor2.text_edit.undo()
+        if _attachment_chars(editor2.text_edit) != list(range(start, end)):
+            print("✗ 撤销后附件标记未恢复")
+            return False
+
+        _press_key_at(editor2.text_edit, start, Qt.Key.Key_Delete)
+        if editor2.text_edit.toPlainText() == prefix:
+            print("✓ 附件已整体删除")
+        else:
+            print("✗ 附件未被整体删除")
+            print(f"  剩余文本: {editor2.text_edit.toPlainText()!r}")
+            return False
+    finally:
+        # 清理测试数据
+        print("\n[清理] 删除测试笔记和附件...")
+        attachment_manager.cleanup_note_attachment_trash(note_id)
+        for attachment in attachment_manager.get_note_attachments(note_id):
+            attachment_manager.delete_attachment(attachment['id'], note_id)
+        manager.permanently_delete_note(note_id)
+        os.remove(temp_file.name)
+        print("✓ 测试数据已清理")
+
+    print("\n" + "=" * 60)
+    print("✅ 所有测试通过！")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == '__main__':
+    try:
+        success = test_attachment_marking()
+        sys.exit(0 if success else 1)
+    except Exception as e:
+        print(f"\n❌ 测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试格式切换：对混合格式的选区切换粗体/斜体/下划线/删除线，不影响各片段原有的字号和颜色
+"""
+
+import sys
+from PyQt6.QtGui import QFont, QTextCursor
+from PyQt6.QtWidgets import QApplication
+from note_editor import NoteEditor
+
+
+def _char_formats(text_edit, start, end):
+    """返回 [start, end) 内每个字符的 (字号, 颜色, 粗细, 斜体, 下划线, 删除线)"""
+    cursor = QTextCursor(text_edit.document())
+    formats = []
+    for pos in range(start, end):
+        cursor.setPosition(pos)
+        cursor.setPosition(pos + 1, QTextCursor.MoveMode.KeepAnchor)
+        fmt = cursor.charFormat()
+        formats.append((
+            fmt.fontPointSize(),
+            fmt.foreground().color().name(),
+            fmt.fontWeight(),
+            fmt.fontItalic(),
+            fmt.fontUnderline(),
+            fmt.fontStrikeOut(),
+        ))
+    return formats
+
+
+def test_format_toggle():
+    """测试对混合字号/颜色的选区切换格式"""
+    print("=" * 60)
+    print("测试格式切换")
+    print("=" * 60)
+
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    editor = NoteEditor()
+    text_edit = editor.text_edit
+    editor.setHtml(
+        '<p>格式测试</p>'
+        '<p><span style="font-size:14pt; color:#008000">small</span> '
+        '<span style="font-size:20pt; color:#ff0000">big red</span></p>'
+    )
+
+    # 选中第二段（第一行是标题，不参与测试）
+    start = text_edit.document().findBlockByNumber(1).position()
+    end = start + len("small big red")
+    cursor = text_edit.textCursor()
+    cursor.setPosition(start)
+    cursor.setPosition(end, QTextCursor.MoveMode.KeepAnchor)
+    text_edit.setTextCursor(cursor)
+
+    original = _char_formats(text_edit, start, end)
+    sizes_and_colors = [fmt[:2] for fmt in original]
+    if len(set(sizes_and_colors)) < 2:
+        print("✗ 测试内容没有形成混合格式")
+        return False
+
+    # 测试1: 切换粗体，每个片段保持原有字号和颜色
+    print("\n[测试1] 切换粗体...")
+    editor.toggle_bold()
+    formats = _char_formats(text_edit, start, end)
+    if ([fmt[:2] for fmt in formats] == sizes_and_colors
+            and all(fmt[2] == QFont.Weight.Bold for fmt in formats)):
+        print("✓ 粗体已应用，字号和颜色保持不变")
+    else:
+        print("✗ 粗体切换后格式错误")
+        print(f"  切换前: {original}")
+        print(f"  切换后: {formats}")
+        return False
+
+    # 测试2: 依次切换斜体、下划线、删除线
+    print("\n[测试2] 切换斜体、下划线、删除线...")
+    editor.toggle_italic()
+    editor.toggle_underline()
+    editor.toggle_strikethrough()
+    formats = _char_formats(text_edit, start, end)
+    if ([fmt[:2] for fmt in formats] == sizes_and_colors
+            and all(fmt[2:] == (QFont.Weight.Bold, True, True, True) for fmt in formats)):
+        print("✓ 格式已叠加，字号和颜色保持不变")
+    else:
+        print("✗ 叠加格式后格式错误")
+        print(f"  切换后: {formats}")
+        return False
+
+    # 测试3: 再次切换全部格式，恢复为原始格式
+    print("\n[测试3] 取消全部格式...")
+    editor.toggle_bold()
+    editor.toggle_italic()
+    editor.toggle_underline()
+    editor.toggle_strikethrough()
+    formats = _char_formats(text_edit, start, end)
+    if formats == original:
+        print("✓ 已恢复原始格式")
+    else:
+        print("✗ 取消格式后与原始格式不一致")
+        print(f"  原始: {original}")
+        print(f"  现在: {formats}")
+        return False
+
+    print("\n" + "=" * 60)
+    print("✅ 所有测试通过！")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == '__main__':
+    try:
+        success = test_format_toggle()
+        sys.exit(0 if success else 1)
+    except Exception as e:
+        print(f"\n❌ 测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -5,7 +5,10 @@
 """
 
 import sys
+from PyQt6.QtCore import QUrl
+from PyQt6.QtGui import QTextCursor, QTextDocument
 from PyQt6.QtWidgets import QApplication
+import note_editor
 from note_editor import NoteEditor
 from note_manager import NoteManager
 
@@ -17,7 +20,7 @@ def test_formula_persistence():
     print("=" * 60)
     
     # 创建应用
-    app = QApplication(sys.argv)
+    app = QApplication.instance() or QApplication(sys.argv)
     
     # 创建编辑器和管理器
     editor = NoteEditor()
@@ -35,19 +38,31 @@ def test_formula_persistence():
     
     # 输出HTML片段用于调试
     print("\n  HTML片段预览:")
-    if 'alt="MATH:' in html_content:
-        start = html_content.find('alt="MATH:')
+    if '|||MATH:' in html_content:
+        start = html_content.find('|||MATH:')
         end = start + 200
         print(f"  {html_content[start:end]}")
     else:
-        print("  未找到alt=\"MATH:标记")
+        print("  未找到|||MATH:标记")
     
-    # 检查是否包含公式标记
-    if 'alt="MATH:latex:' in html_content:
+    # 检查是否包含公式标记（公式图片在文档里登记为 formula:// 资源，保存时须还原为 data URI）
+    if '|||MATH:latex:' in html_content and 'formula://' not in html_content:
         print("\n✓ HTML包含公式元数据")
     else:
         print("\n✗ HTML缺少公式元数据")
-        print("  检查: alt=\"MATH:存在?", 'alt="MATH:' in html_content)
+        print("  检查: |||MATH:存在?", '|||MATH:' in html_content)
+        print("  检查: formula://残留?", 'formula://' in html_content)
+        return False
+    
+    # 测试1b: 复制选区得到的HTML同样是 data URI 形式
+    print("\n[测试1b] 复制公式...")
+    editor.text_edit.selectAll()
+    copied_html = editor.text_edit.createMimeDataFromSelection().html()
+    if ('data:image/png;base64,' in copied_html and '|||MATH:latex:' in copied_html
+            and 'formula://' not in copied_html):
+        print("✓ 复制的HTML包含公式数据")
+    else:
+        print("✗ 复制的HTML缺少公式数据")
         return False
     
     # 测试2: 保存到数据库
@@ -67,7 +82,7 @@ def test_formula_persistence():
         print(f"  内容长度: {len(note['content'])} 字符")
         
         # 检查内容是否包含公式标记
-        if 'alt="MATH:latex:' in note['content']:
+        if '|||MATH:latex:' in note['content']:
             print("✓ 加载的内容包含公式元数据")
         else:
             print("✗ 加载的内容缺少公式元数据")
@@ -87,12 +102,84 @@ def test_formula_persistence():
     print(f"  重新渲染后HTML长度: {len(rerendered_html)} 字符")
     
     # 检查是否仍然包含公式标记
-    if 'alt="MATH:latex:' in rerendered_html:
+    if '|||MATH:latex:' in rerendered_html and 'formula://' not in rerendered_html:
         print("✓ 重新渲染后仍保留公式元数据")
     else:
         print("✗ 重新渲染后丢失公式元数据")
         return False
     
+    # 测试4a: 旧格式公式按需绘制时只渲染，不提交后台PNG编码任务（保存时直接写回原有数据）
+    print("\n[测试4a] 按需渲染旧格式公式...")
+    encode_tasks = []
+    original_task_class = note_editor._FormulaEncodeTask
+    
+    class CountingEncodeTask(original_task_class):
+        def __init__(self, key, image):
+            super().__init__(key, image)
+            encode_tasks.append(key)
+    
+    note_editor._FormulaEncodeTask = CountingEncodeTask
+    try:
+        editor_lazy = NoteEditor()
+        editor_lazy.setHtml(note['content'])
+        legacy_names = list(editor_lazy._legacy_formulas)
+        images = [
+            editor_lazy.text_edit.loadResource(
+                QTextDocument.ResourceType.ImageResource.value, QUrl(name)
+            )
+            for name in legacy_names
+        ]
+    finally:
+        note_editor._FormulaEncodeTask = original_task_class
+    
+    if (legacy_names and all(image is not None and not image.isNull() for image in images)
+            and not encode_tasks):
+        print("✓ 旧格式公式已渲染，未提交编码任务")
+    else:
+        print("✗ 旧格式公式按需渲染错误")
+        print("  旧格式公式数:", len(legacy_names), "编码任务:", encode_tasks)
+        return False
+    
+    # 测试4b: 加载后的公式可以双击编辑（不弹出对话框，直接用新代码更新公式）
+    print("\n[测试4b] 编辑加载后的公式...")
+    new_latex_code = r"e^{i\pi} + 1 = 0"
+    edit_requests = []
+    
+    def fake_edit_math_formula(code, formula_type, image_cursor, image_format):
+        edit_requests.append((formula_type, code))
+        editor2._update_formula_image(new_latex_code, formula_type, image_cursor, image_format)
+    
+    editor2.edit_math_formula = fake_edit_math_formula
+    
+    doc = editor2.text_edit.document()
+    handled = False
+    block = doc.begin()
+    while block.isValid() and not handled:
+        it = block.begin()
+        while not it.atEnd():
+            fragment = it.fragment()
+            char_format = fragment.charFormat()
+            if char_format.isImageFormat():
+                # 与双击命中测试一致：光标位于图片字符的起始位置
+                image_cursor = QTextCursor(doc)
+                image_cursor.setPosition(fragment.position())
+                handled = editor2.text_edit._handle_math_formula_double_click(
+                    char_format.toImageFormat(), image_cursor
+                )
+                break
+            it += 1
+        block = block.next()
+    
+    edited_html = editor2.toHtml()
+    if (handled and edit_requests == [('latex', latex_code)]
+            and f'|||MATH:latex:{new_latex_code}' in edited_html
+            and 'formula://' not in edited_html):
+        print("✓ 公式编辑成功")
+    else:
+        print("✗ 公式编辑失败")
+        print("  双击已处理?", handled, "编辑请求:", edit_requests)
+        return False
+    
     # 测试5: 测试MathML公式
     print("\n[测试5] 测试MathML公式...")
     editor3 = NoteEditor()
@@ -100,7 +187,7 @@ def test_formula_persistence():
     editor3.insert_math_formula(mathml_code, 'mathml')
     
     mathml_html = editor3.toHtml()
-    if 'alt="MATH:mathml:' in mathml_html:
+    if '|||MATH:mathml:' in mathml_html and 'formula://' not in mathml_html:
         print("✓ MathML公式元数据正确")
     else:
         print("✗ MathML公式元数据错误")